@@ -88,7 +88,7 @@ resource "azurerm_storage_container" "tfstate" {
   container_access_type = "private"
 }
 
-# Queue for async processing (if needed in future)
+# Queue between the HandleFailure webhook and the ProcessFailure worker
 resource "azurerm_storage_queue" "failures" {
   name                 = "pipeline-failures"
   storage_account_name = azurerm_storage_account.main.name
@@ -2,21 +2,25 @@
 Azure Pipeline YAML-specific failure analysis
 """
 
+import re
 import logging
 from typing import Dict
 
 
+# All detector keywords in one alternation so the log is scanned once
+YAML_KEYWORDS_PATTERN = '|'.join(re.escape(keyword) for keyword in [
+    "YAML syntax error",
+    "Invalid YAML",
+    "Pipeline YAML",
+    "##[error]",
+    "Job ... depends on invalid job"
+])
+_YAML_KEYWORDS_RE = re.compile(YAML_KEYWORDS_PATTERN)
+
+
 def is_pipeline_yaml_failure(build_logs: str) -> bool:
     """Detect if this is a pipeline YAML syntax error"""
-    yaml_keywords = [
-        "YAML syntax error",
-        "Invalid YAML",
-        "Pipeline YAML",
-        "##[error]",
-        "Job ... depends on invalid job"
-    ]
-    
-    return any(keyword in build_logs for keyword in yaml_keywords)
+    return _YAML_KEYWORDS_RE.search(build_logs) is not None
 
 
 async def analyze_yaml_failure(context: Dict, openai_client) -> Dict:
@@ -3,53 +3,201 @@ Terraform-specific failure analysis
 """
 
 import re
+import hashlib
 import logging
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Dict
 
 
+__all__ = (
+    'TERRAFORM_KEYWORDS_PATTERN',
+    'is_terraform_failure',
+    'detect_error_pattern',
+    'extract_terraform_error',
+    'can_be_autofixed',
+    'analyze_terraform_failure',
+    'analyze_missing_variable',
+    'analyze_invalid_region',
+    'generate_variable_fix',
+    'analyze_with_ai',
+)
+
+# AI results keyed by a hash of the log section sent to the model, so
+# reruns of the same failure don't pay for another OpenAI call
+_AI_CACHE: "OrderedDict[str, dict]" = OrderedDict()
+_AI_CACHE_MAX = 512
+
+# Final verdicts keyed by a hash of the full build log, checked before any
+# pattern detection or AI analysis runs
+_VERDICT_CACHE: "OrderedDict[bytes, dict]" = OrderedDict()
+_VERDICT_CACHE_MAX = 1024
+
+# Static prompt text for analyze_with_ai; only the log section is filled in per call
+_PROMPT_TEMPLATE = """
+Analyze this Terraform pipeline failure and provide a structured response.
+
+Build Logs (Error Section):
+{relevant_logs}
+
+Provide your analysis in this EXACT format:
+CATEGORY: <one of: Configuration Error, Syntax Error, Authentication Error, State Error, Provider Error>
+CONFIDENCE: <0.0 to 1.0>
+EXPLANATION: <detailed explanation of what went wrong>
+CAN_AUTOFIX: <True or False>
+SUGGESTED_FIX: <specific steps to fix>
+
+Guidelines for CAN_AUTOFIX:
+- True for: Missing variables, wrong values, incorrect region names
+- False for: Syntax errors, authentication issues, state conflicts
+
+Be specific and actionable. Focus on the Terraform error, not the pipeline YAML.
+"""
+
+_SYSTEM_MESSAGE = """You are an expert DevOps engineer specializing in Terraform and infrastructure as code. 
+Analyze pipeline failures and provide accurate root cause analysis with actionable fixes.
+
+For CAN_AUTOFIX decision:
+- Set to True if the fix is a simple configuration change (adding a variable, fixing a value, correcting a region name)
+- Set to False if the fix requires human judgment (syntax errors, authentication, state management)
+
+Focus on Terraform errors in the logs, not the pipeline definition itself.
+"""
+
+# Categories that are safe to auto-fix
+_AUTO_FIXABLE = frozenset({
+    'TERRAFORM_MISSING_VARIABLE',
+    'TERRAFORM_WRONG_REGION',
+    'TERRAFORM_WRONG_VALUE',
+    'Configuration Error'
+})
+
+# Compiled once at import; these run on every failure analysis
+_ERROR_LINE_RE = re.compile(r'Error: (.+?)(?:\n|$)')
+_VAR_NAME_RE = re.compile(r'variable "([^"]+)"')
+_AI_FIELDS = ('CATEGORY', 'CONFIDENCE', 'CAN_AUTOFIX')
+_AI_FIELD_RE = re.compile(rf'^({"|".join(_AI_FIELDS)}):[ \t]*(.*?)\s*$', re.MULTILINE)
+
+# Explanation keywords that override the AI's structured answer.
+# "missing" and "variable" are matched separately since either order counts.
+_OVERRIDE_RE = re.compile(
+    r'(?P<syntax>syntax error|missing brace|invalid character|unexpected token)'
+    r'|(?P<wrong_region>wrong region|invalid region|incorrect region|not found in the list)'
+    r'|(?P<missing>missing)'
+    r'|(?P<variable>variable)',
+    re.IGNORECASE
+)
+
+# Explanation keywords used for the final auto-fix decision. "missing closing
+# brace" also counts as "missing", which the caller adds back in.
+_EXPLANATION_HINT_RE = re.compile(
+    r'(?P<syntax_error>syntax error)'
+    r'|(?P<missing_brace>missing closing brace)'
+    r'|(?P<invalid_character>invalid character)'
+    r'|(?P<region>wrong region|invalid region)'
+    r'|(?P<missing>missing)'
+    r'|(?P<variable>variable)',
+    re.IGNORECASE
+)
+
+# override -> (category, can_autofix, confidence floor)
+_OVERRIDES = {
+    'missing_variable': ("TERRAFORM_MISSING_VARIABLE", True, 0.85),
+    'wrong_region': ("TERRAFORM_WRONG_REGION", True, 0.85),
+    'syntax': ("TERRAFORM_SYNTAX_ERROR", False, 0.90),  # NEVER autofix
+}
+
+# Error patterns recognised ahead of AI analysis, scanned in one pass
+_DETECT_PATTERN = (
+    r'(?P<MV>Reference to undeclared input variable)'
+    r'|(?P<WR>was not found in the list of supported Azure Locations)'
+    r'|(?P<SE>Invalid character|Extra characters after interpolation|Missing closing brace)'
+)
+_DETECT_RE = re.compile(_DETECT_PATTERN)
+_DETECT_KIND = {
+    'MV': ('TERRAFORM_MISSING_VARIABLE', 0.95),
+    'WR': ('TERRAFORM_WRONG_REGION', 0.90),
+    'SE': ('TERRAFORM_SYNTAX_ERROR', 0.95),
+}
+# Missing variable wins over wrong region, which wins over syntax errors
+_DETECT_PRIORITY = ('MV', 'WR', 'SE')
+
+# All Terraform detector keywords, matched case-insensitively
+TERRAFORM_KEYWORDS_PATTERN = (
+    r'terraform'
+    r'|Error: Missing required variable'
+    r'|Error: Invalid location'
+    r'|Error: Unsupported argument'
+    r'|Error: Reference to undeclared'
+    r'|azurerm_'
+)
+_IS_TF_RE = re.compile(TERRAFORM_KEYWORDS_PATTERN, re.IGNORECASE)
+
+# Definitely auto-fixable
+_AUTO_FIXABLE_PATTERNS = (
+    'variable .* was not set',
+    'variable .* not defined',
+    'missing required variable',
+    'invalid region',
+    'wrong region',
+    'should be .* not .*',
+    'expected .* got .*',
+    'invalid location',
+)
+
+# Definitely NOT auto-fixable
+_MANUAL_REVIEW_PATTERNS = (
+    'syntax error',
+    'expected .* block',
+    'missing closing brace',
+    'unexpected token',
+    'authentication failed',
+    'state conflict',
+    'state locked',
+)
+
+# One alternation per list; each pattern is grouped so it stays self-contained
+_AUTO_FIXABLE_RE = re.compile('|'.join(f'(?:{p})' for p in _AUTO_FIXABLE_PATTERNS))
+_MANUAL_REVIEW_RE = re.compile('|'.join(f'(?:{p})' for p in _MANUAL_REVIEW_PATTERNS))
+
+
 def is_terraform_failure(build_logs: str) -> bool:
     """Detect if this is a Terraform failure"""
-    terraform_keywords = [
-        "terraform",
-        "Error: Missing required variable",
-        "Error: Invalid location",
-        "Error: Unsupported argument",
-        "Error: Reference to undeclared",
-        "azurerm_"
-    ]
-    
-    logs_lower = build_logs.lower()
-    return any(keyword.lower() in logs_lower for keyword in terraform_keywords)
+    return _IS_TF_RE.search(build_logs) is not None
 
 def detect_error_pattern(build_logs: str) -> tuple:
     """
     Detect specific Terraform error patterns
     Returns: (pattern_name, confidence_boost)
     """
-    
-    # Pattern 1: Missing Variable (highest priority)
-    if 'Reference to undeclared input variable' in build_logs:
-        return ('TERRAFORM_MISSING_VARIABLE', 0.95)
-    
-    # Pattern 2: Wrong Region
-    if 'was not found in the list of supported Azure Locations' in build_logs:
-        return ('TERRAFORM_WRONG_REGION', 0.90)
-    
-    # Pattern 3: Syntax Error
-    if any(s in build_logs for s in ['Invalid character', 'Extra characters after interpolation', 'Missing closing brace']):
-        return ('TERRAFORM_SYNTAX_ERROR', 0.95)
+    best = None
+    for match in _DETECT_RE.finditer(build_logs):
+        kind = match.lastgroup
+        if kind == 'MV':
+            # Highest priority, nothing later can beat it
+            return _DETECT_KIND['MV']
+        if best is None or _DETECT_PRIORITY.index(kind) < _DETECT_PRIORITY.index(best):
+            best = kind
+    
+    if best:
+        return _DETECT_KIND[best]
     
     return (None, None)
 
 
 def extract_terraform_error(build_logs: str) -> str:
     """Extract the specific Terraform error message"""
-    # Look for "Error:" lines
-    error_pattern = r'Error: (.+?)(?:\n|$)'
-    matches = re.findall(error_pattern, build_logs, re.MULTILINE)
+    # Cheap substring probe first; most logs on the success path have no
+    # error at all, and when there is one the regex starts right on it
+    idx = build_logs.find('Error: ')
+    if idx < 0:
+        return "Unknown Terraform error"
+    
+    # Look for the first "Error:" line
+    match = _ERROR_LINE_RE.search(build_logs, idx)
     
-    if matches:
-        return matches[0]
+    if match:
+        return match.group(1)
     
     return "Unknown Terraform error"
 
@@ -66,36 +214,11 @@ def can_be_autofixed(error_message: str, category: str) -> bool:
     """
     error_lower = error_message.lower()
     
-    # Definitely auto-fixable
-    auto_fixable_patterns = [
-        'variable .* was not set',
-        'variable .* not defined',
-        'missing required variable',
-        'invalid region',
-        'wrong region',
-        'should be .* not .*',
-        'expected .* got .*',
-        'invalid location',
-    ]
-    
-    for pattern in auto_fixable_patterns:
-        if re.search(pattern, error_lower):
-            return True
-    
-    # Definitely NOT auto-fixable
-    manual_review_patterns = [
-        'syntax error',
-        'expected .* block',
-        'missing closing brace',
-        'unexpected token',
-        'authentication failed',
-        'state conflict',
-        'state locked',
-    ]
-    
-    for pattern in manual_review_patterns:
-        if re.search(pattern, error_lower):
-            return False
+    if _AUTO_FIXABLE_RE.search(error_lower):
+        return True
+    
+    if _MANUAL_REVIEW_RE.search(error_lower):
+        return False
     
     # Default: safe errors are auto-fixable
     if category in ['TERRAFORM_MISSING_VARIABLE', 'TERRAFORM_WRONG_REGION']:
@@ -109,6 +232,16 @@ async def analyze_terraform_failure(failure_info: dict, openai_client) -> dict:
     
     build_logs = failure_info.get('build_logs', '')
     
+    # Identical logs (flaky retries, matrix legs) get the stored verdict
+    fingerprint = hashlib.blake2b(build_logs.encode(), digest_size=16).digest()
+    cached = _VERDICT_CACHE.get(fingerprint)
+    if cached is not None:
+        _VERDICT_CACHE.move_to_end(fingerprint)
+        logging.info("♻️ Reusing cached Terraform verdict for identical logs")
+        return dict(cached)
+    
+    # The keyword search stops at the first hit; only Terraform logs pay
+    # for the error-pattern scan
     if not is_terraform_failure(build_logs):
         return None
     
@@ -120,6 +253,7 @@ async def analyze_terraform_failure(failure_info: dict, openai_client) -> dict:
     
     # Get AI analysis
     result = await analyze_with_ai(failure_info, openai_client)
+    ai_failed = result.get('category') == 'UNKNOWN_ERROR'
     
     # Override AI if we have high-confidence pattern
     if pattern and pattern_confidence >= 0.90:
@@ -132,7 +266,12 @@ async def analyze_terraform_failure(failure_info: dict, openai_client) -> dict:
     
     # NOW use the corrected category
     category = result.get('category', 'TERRAFORM_ERROR')
-    explanation = result.get('explanation', '').lower()
+    explanation = result.get('explanation', '')
+    
+    # Collect every explanation keyword in one scan
+    hints = {m.lastgroup for m in _EXPLANATION_HINT_RE.finditer(explanation)} if explanation else set()
+    if 'missing_brace' in hints:
+        hints.add('missing')
     
     # Check for syntax errors using CATEGORY (not explanation)
     is_syntax_error = (
@@ -143,9 +282,9 @@ async def analyze_terraform_failure(failure_info: dict, openai_client) -> dict:
     # Only check explanation if category isn't clear
     if not is_syntax_error:
         is_syntax_error = (
-            'syntax error' in explanation and
-            'missing closing brace' in explanation or
-            'invalid character' in explanation
+            'syntax_error' in hints and
+            'missing_brace' in hints or
+            'invalid_character' in hints
         )
     
     if is_syntax_error:
@@ -153,31 +292,28 @@ async def analyze_terraform_failure(failure_info: dict, openai_client) -> dict:
         logging.info(f"🔧 Auto-fix denied: Syntax error detected")
     else:
         # Check for safe auto-fixable patterns
-        AUTO_FIXABLE = [
-            'TERRAFORM_MISSING_VARIABLE',
-            'TERRAFORM_WRONG_REGION',
-            'TERRAFORM_WRONG_VALUE',
-            'Configuration Error'
-        ]
-        
         can_autofix = (
-            category in AUTO_FIXABLE or
-            ('missing' in explanation and 'variable' in explanation) or
-            ('wrong region' in explanation) or
-            ('invalid region' in explanation)
+            category in _AUTO_FIXABLE or
+            ('missing' in hints and 'variable' in hints) or
+            ('region' in hints)
         )
         
         result['can_autofix'] = can_autofix
         logging.info(f"🔧 Auto-fix decision: {can_autofix} (category: {category})")
     
+    # Don't pin a verdict that came from a failed AI call
+    if not ai_failed:
+        _VERDICT_CACHE[fingerprint] = dict(result)
+        if len(_VERDICT_CACHE) > _VERDICT_CACHE_MAX:
+            _VERDICT_CACHE.popitem(last=False)
+    
     return result
 
 
 def analyze_missing_variable(error_message: str, context: Dict) -> Dict:
     """Analyze missing Terraform variable error"""
     # Extract variable name from error
-    var_pattern = r'variable "([^"]+)"'
-    match = re.search(var_pattern, error_message)
+    match = _VAR_NAME_RE.search(error_message)
     
     if match:
         var_name = match.group(1)
@@ -211,6 +347,7 @@ def analyze_invalid_region(error_message: str, context: Dict) -> Dict:
     }
 
 
+@lru_cache(maxsize=256)
 def generate_variable_fix(var_name: str) -> str:
     """Generate YAML fix for missing variable"""
     return f"""# Add to azure-pipelines.yml
@@ -232,45 +369,32 @@ async def analyze_with_ai(
     # CRITICAL: Extract the relevant error section, not the entire log
     # Terraform errors appear at the END of logs, not the beginning
     if len(build_logs) > 10000:
-        # Get last 5000 chars where actual errors are
-        relevant_logs = build_logs[-5000:]
-        logging.info(f"📋 Using last 5000 chars of {len(build_logs)} total chars")
+        # Anchor on the last "Error:" so the window holds the error itself,
+        # falling back to the last 5000 chars if there is none
+        idx = build_logs.rfind('Error:')
+        if idx >= 0:
+            start = max(0, idx - 500)
+            relevant_logs = build_logs[start:start + 4000]
+        else:
+            start = len(build_logs) - 5000
+            relevant_logs = build_logs[start:]
+        logging.info(f"📋 Using {len(relevant_logs)} chars at offset {start} of {len(build_logs)} total chars")
     else:
         relevant_logs = build_logs
         logging.info(f"📋 Using all {len(build_logs)} chars (short log)")
     
-    prompt = f"""
-Analyze this Terraform pipeline failure and provide a structured response.
-
-Build Logs (Error Section):
-{relevant_logs}
-
-Provide your analysis in this EXACT format:
-CATEGORY: <one of: Configuration Error, Syntax Error, Authentication Error, State Error, Provider Error>
-CONFIDENCE: <0.0 to 1.0>
-EXPLANATION: <detailed explanation of what went wrong>
-CAN_AUTOFIX: <True or False>
-SUGGESTED_FIX: <specific steps to fix>
-
-Guidelines for CAN_AUTOFIX:
-- True for: Missing variables, wrong values, incorrect region names
-- False for: Syntax errors, authentication issues, state conflicts
-
-Be specific and actionable. Focus on the Terraform error, not the pipeline YAML.
-"""
+    cache_key = hashlib.blake2b(relevant_logs.encode(), digest_size=16).hexdigest()
+    cached = _AI_CACHE.get(cache_key)
+    if cached is not None:
+        _AI_CACHE.move_to_end(cache_key)
+        logging.info(f"♻️ Reusing cached AI analysis ({cache_key})")
+        # Callers mutate the result, so hand out a copy
+        return dict(cached)
     
-    system_message = """You are an expert DevOps engineer specializing in Terraform and infrastructure as code. 
-Analyze pipeline failures and provide accurate root cause analysis with actionable fixes.
-
-For CAN_AUTOFIX decision:
-- Set to True if the fix is a simple configuration change (adding a variable, fixing a value, correcting a region name)
-- Set to False if the fix requires human judgment (syntax errors, authentication, state management)
-
-Focus on Terraform errors in the logs, not the pipeline definition itself.
-"""
+    prompt = _PROMPT_TEMPLATE.format(relevant_logs=relevant_logs)
     
     try:
-        response = await openai_client.analyze(prompt, system_message)
+        response = await openai_client.analyze(prompt, _SYSTEM_MESSAGE)
         
         # Parse the response
         category = "TERRAFORM_ERROR"
@@ -278,54 +402,54 @@ Focus on Terraform errors in the logs, not the pipeline definition itself.
         explanation = response
         can_autofix = False
         
-        # Extract structured fields
-        for line in response.split('\n'):
-            if line.startswith('CATEGORY:'):
-                category_text = line.replace('CATEGORY:', '').strip()
-                # Map to our categories
-                if 'configuration' in category_text.lower():
-                    category = "TERRAFORM_MISSING_VARIABLE"
-                elif 'syntax' in category_text.lower():
-                    category = "TERRAFORM_SYNTAX_ERROR"
-                    
-            elif line.startswith('CONFIDENCE:'):
-                try:
-                    confidence = float(line.replace('CONFIDENCE:', '').strip())
-                except:
-                    confidence = 0.7
-                    
-            elif line.startswith('CAN_AUTOFIX:'):
-                autofix_text = line.replace('CAN_AUTOFIX:', '').strip().lower()
-                can_autofix = autofix_text in ['true', 'yes', '1']
-        
-        # Smart overrides based on error patterns
-        explanation_lower = explanation.lower()
+        # Extract structured fields in a single scan of the response,
+        # stopping as soon as all of them have been seen
+        fields = {}
+        for match in _AI_FIELD_RE.finditer(response):
+            fields.setdefault(match.group(1), match.group(2))
+            if len(fields) == len(_AI_FIELDS):
+                break
         
-        # Missing variable pattern
-        if 'missing' in explanation_lower and 'variable' in explanation_lower:
-            can_autofix = True
+        category_text = fields.get('CATEGORY', '').lower()
+        # Map to our categories
+        if 'configuration' in category_text:
             category = "TERRAFORM_MISSING_VARIABLE"
-            confidence = max(confidence, 0.85)
+        elif 'syntax' in category_text:
+            category = "TERRAFORM_SYNTAX_ERROR"
         
-        # Wrong region/value pattern
-        if any(word in explanation_lower for word in ['wrong region', 'invalid region', 'incorrect region', 'not found in the list']):
-            can_autofix = True
-            category = "TERRAFORM_WRONG_REGION"
-            confidence = max(confidence, 0.85)
+        if 'CONFIDENCE' in fields:
+            try:
+                confidence = float(fields['CONFIDENCE'])
+            except ValueError:
+                confidence = 0.7
         
-        # Syntax error pattern - NEVER autofix
-        if any(word in explanation_lower for word in ['syntax error', 'missing brace', 'invalid character', 'unexpected token']):
-            can_autofix = False
-            category = "TERRAFORM_SYNTAX_ERROR"
-            confidence = max(confidence, 0.90)
+        if 'CAN_AUTOFIX' in fields:
+            can_autofix = fields['CAN_AUTOFIX'].lower() in ['true', 'yes', '1']
         
-        return {
+        # Smart overrides based on error patterns, collected in one scan
+        hits = {m.lastgroup for m in _OVERRIDE_RE.finditer(explanation)} if explanation else set()
+        if 'missing' in hits and 'variable' in hits:
+            hits.add('missing_variable')
+        
+        # Applied in order so a syntax error always has the last word
+        for override in ('missing_variable', 'wrong_region', 'syntax'):
+            if override in hits:
+                category, can_autofix, confidence_floor = _OVERRIDES[override]
+                confidence = max(confidence, confidence_floor)
+        
+        result = {
             "category": category,
             "confidence": min(confidence, 0.95),  # Cap at 0.95
             "explanation": explanation,
             "can_autofix": can_autofix
         }
         
+        _AI_CACHE[cache_key] = dict(result)
+        if len(_AI_CACHE) > _AI_CACHE_MAX:
+            _AI_CACHE.popitem(last=False)
+        
+        return result
+        
     except Exception as e:
         logging.error(f"Error in AI analysis: {str(e)}")
         return {
@@ -4,88 +4,189 @@ Main Azure Function that handles pipeline failure webhooks
 """
 
 import azure.functions as func
+import asyncio
 import logging
-import json
+import orjson
 import os
-from datetime import datetime
+import re
+import threading
+import time
+import traceback
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional
+
+from analyzers.terraform_analyzer import TERRAFORM_KEYWORDS_PATTERN, analyze_terraform_failure
+from analyzers.pipeline_analyzer import YAML_KEYWORDS_PATTERN, analyze_yaml_failure
+from shared.ado_client import get_ado_client
+from shared.openai_client import get_client as get_openai_client
+from shared.github_operations import GitHubOperations
+from shared.git_operations import GitOperations
+from shared.code_generator import generate_terraform_fix
 
 app = func.FunctionApp()
 
+# Storage queue between the webhook and the healing pipeline
+# (provisioned by infrastructure/core/terraform)
+FAILURE_QUEUE = "pipeline-failures"
+
+# failure_context field -> webhook payload field
+WEBHOOK_FIELDS = (
+    ("pipeline_id", "pipelineId"),
+    ("build_id", "buildId"),
+    ("build_number", "buildNumber"),
+    ("pr_id", "prId"),
+    ("failed_stage", "failedStage"),
+    ("failed_job", "failedJob"),
+    ("failed_task", "failedTask"),
+    ("repo_url", "repoUrl"),
+    ("source_branch", "sourceBranch"),
+    ("project_name", "projectName"),
+    ("organization_url", "organizationUrl"),
+)
+
+# Service clients are cached per worker so warm invocations reuse their
+# connection pools and auth instead of rebuilding them per request
+# (the Azure DevOps and OpenAI clients come from get_ado_client and
+# shared.openai_client.get_client)
+_github_ops = None
+_git_ops = None
+
+# Pipeline YAML and last-successful-build logs rarely change, so failure
+# storms on one pipeline share them for a few minutes. Strings (build logs
+# compress 5-10x) are held zlib-compressed.
+# key -> (expires_at, value, compressed)
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "300"))
+CONTEXT_CACHE_MAX = int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", "256"))
+_context_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_context_cache_locks = {}
+
+# ADO retries webhooks on 5xx and several failed tasks in one build each
+# fire one, so builds healed recently or still in flight are not run again.
+# build_id -> (expires_at, action_result)
+RESULT_CACHE_TTL = 900
+RESULT_CACHE_MAX = 1024
+_recent_results: "OrderedDict[object, tuple]" = OrderedDict()
+_in_flight = {}
+
+# Terraform and pipeline YAML detector keywords combined for one-pass routing.
+# The scan runs inside the C regex engine, so a native (e.g. Numba) matcher
+# would only save the str -> bytes encode it would need first.
+_FAILURE_KIND_RE = re.compile(
+    rf'(?P<terraform>(?i:{TERRAFORM_KEYWORDS_PATTERN}))|(?P<yaml>{YAML_KEYWORDS_PATTERN})'
+)
+
+# Logs handed to the prompt-based analyzers are cut down to the start of
+# the run plus the tail, where the failing step almost always reports
+LOG_HEAD_CHARS = 2048
+LOG_TAIL_CHARS = 8192
+
+# PR files worth showing the analyzers for each failure kind
+_PR_FILE_EXTENSIONS = {
+    'terraform': ('.tf', '.tfvars', '.hcl'),
+    'yaml': ('.yml', '.yaml'),
+}
+
+# Repository name in an Azure Repos URL (https://dev.azure.com/org/project/_git/repo)
+_ADO_REPO_RE = re.compile(r'/_git/(?P<repo>[^/?#]+)')
+
+# Any sign of an error in an otherwise unrecognised log
+_GENERIC_ERROR_RE = re.compile(r'error|failed', re.IGNORECASE)
+
+# Failures that no code change can fix (cancelled runs, agent pool outages)
+_SKIP_FAILURE_RE = re.compile(r'cancel|PoolHasNoAgents|No agent found', re.IGNORECASE)
+
+
+def _get_github():
+    global _github_ops
+    if _github_ops is None:
+        _github_ops = GitHubOperations()
+    return _github_ops
+
+
+def _get_git_ops():
+    global _git_ops
+    if _git_ops is None:
+        # Share the ADO client's connection pool instead of opening a second one
+        _git_ops = GitOperations(connection=get_ado_client().connection)
+    return _git_ops
+
+
+def _warm_ado_client() -> None:
+    try:
+        get_ado_client()
+    except Exception as e:
+        logging.warning(f"Could not prepare Azure DevOps client: {str(e)}")
+
+
+# Building the ADO client resolves the organization's resource areas and
+# creates the build, git and work item SDK clients. Start that when the
+# worker loads so the first failure doesn't wait for it; get_ado_client's
+# lock makes early callers wait for this build instead of starting another.
+threading.Thread(target=_warm_ado_client, name="ado-warmup", daemon=True).start()
+
+
 ################################################################################
 # Webhook Handler - Entry Point
 ################################################################################
 
 @app.function_name(name="HandleFailure")
 @app.route(route="HandleFailure", auth_level=func.AuthLevel.FUNCTION, methods=["POST"])
-async def handle_failure(req: func.HttpRequest) -> func.HttpResponse:
+@app.queue_output(arg_name="msg", queue_name=FAILURE_QUEUE, connection="AzureWebJobsStorage")
+async def handle_failure(req: func.HttpRequest, msg: func.Out[str]) -> func.HttpResponse:
     """
     Receives webhook from Azure DevOps when pipeline fails.
     Triggered by failed pipeline task.
+    Validates the payload and queues it for ProcessFailure.
     """
     logging.info('Pipeline failure webhook received')
     
     try:
         # Parse request body
-        req_body = req.get_json()
+        req_body = orjson.loads(req.get_body())
         
         # Extract failure context
-        failure_context = {
-            "timestamp": datetime.utcnow().isoformat(),
-            "pipeline_id": req_body.get('pipelineId'),
-            "build_id": req_body.get('buildId'),
-            "build_number": req_body.get('buildNumber'),
-            "pr_id": req_body.get('prId'),
-            "failed_stage": req_body.get('failedStage'),
-            "failed_job": req_body.get('failedJob'),
-            "failed_task": req_body.get('failedTask'),
-            "repo_url": req_body.get('repoUrl'),
-            "source_branch": req_body.get('sourceBranch'),
-            "project_name": req_body.get('projectName'),
-            "organization_url": req_body.get('organizationUrl')
-        }
+        failure_context = {"timestamp": datetime.now(timezone.utc).isoformat()}
+        for field, webhook_field in WEBHOOK_FIELDS:
+            failure_context[field] = req_body.get(webhook_field)
+        
+        # Parsed once here; the worker reads it instead of re-parsing repo_url
+        failure_context["repo_id"] = _ado_repo_name(failure_context["repo_url"])
         
-        logging.info(f"Failure context: {json.dumps(failure_context, indent=2)}")
+        # %-style so the dict is only formatted when INFO is enabled
+        logging.info("Failure context: %s", failure_context)
         
         # Validate required fields
         if not failure_context['build_id'] or not failure_context['project_name']:
             return func.HttpResponse(
-                json.dumps({"error": "Missing required fields: buildId or projectName"}),
+                orjson.dumps({"error": "Missing required fields: buildId or projectName"}),
                 mimetype="application/json",
                 status_code=400
             )
         
-        # TODO: In production, queue this for async processing
-        # For now, we'll process synchronously for simplicity
-        
-        # Step 1: Gather context (logs, PR diff, etc.)
-        logging.info("Gathering failure context...")
-        context = await gather_failure_context(failure_context)
-        
-        # Step 2: Analyze with AI
-        logging.info("Analyzing failure with OpenAI...")
-        rca_result = await analyze_with_ai(context)
-        
-        # Step 3: Take action based on confidence
-        logging.info("Executing remediation...")
-        action_result = await execute_remediation(rca_result, context)
-        
-        # Return response
-        response = {
-            "status": "success",
-            "failure_context": failure_context,
-            "rca": {
-                "category": rca_result.get("category"),
-                "confidence": rca_result.get("confidence"),
-                "explanation": rca_result.get("explanation")
-            },
-            "action_taken": action_result.get("action"),
-            "details": action_result.get("details")
-        }
+        if _is_duplicate_build(failure_context['build_id']):
+            logging.info(f"Build {failure_context['build_id']} already handled - not queuing again")
+            return func.HttpResponse(
+                orjson.dumps({
+                    "status": "duplicate",
+                    "build_id": failure_context['build_id']
+                }),
+                mimetype="application/json",
+                status_code=202
+            )
         
-        logging.info(f"Processing complete: {response['action_taken']}")
+        # Hand off to the queue-triggered ProcessFailure function so the
+        # webhook is acknowledged right away instead of after the full run
+        msg.set(orjson.dumps(failure_context).decode())
+        logging.info(f"Queued build {failure_context['build_id']} for processing")
         
         return func.HttpResponse(
-            json.dumps(response, indent=2),
+            orjson.dumps({
+                "status": "accepted",
+                "build_id": failure_context['build_id']
+            }),
             mimetype="application/json",
             status_code=202
         )
@@ -93,7 +194,7 @@ async def handle_failure(req: func.HttpRequest) -> func.HttpResponse:
     except ValueError as e:
         logging.error(f"Invalid JSON in request: {str(e)}")
         return func.HttpResponse(
-            json.dumps({"error": "Invalid JSON payload"}),
+            orjson.dumps({"error": "Invalid JSON payload"}),
             mimetype="application/json",
             status_code=400
         )
@@ -101,16 +202,113 @@ async def handle_failure(req: func.HttpRequest) -> func.HttpResponse:
     except Exception as e:
         logging.error(f"Error processing failure: {str(e)}", exc_info=True)
         return func.HttpResponse(
-            json.dumps({"error": str(e)}),
+            orjson.dumps({"error": str(e)}),
             mimetype="application/json",
             status_code=500
         )
 
 
+################################################################################
+# Queue Worker - Healing Pipeline
+################################################################################
+
+@app.function_name(name="ProcessFailure")
+@app.queue_trigger(arg_name="msg", queue_name=FAILURE_QUEUE, connection="AzureWebJobsStorage")
+async def process_failure(msg: func.QueueMessage) -> None:
+    """
+    Runs the healing pipeline for a failure queued by HandleFailure.
+    Unhandled errors propagate so the Functions host retries the message.
+    """
+    failure_context = orjson.loads(msg.get_body())
+    build_id = failure_context.get('build_id')
+    logging.info(f"Processing queued failure for build {build_id}")
+    
+    if not should_deep_analyze(failure_context):
+        logging.info(
+            f"Remediation SKIPPED for build {build_id}: "
+            f"task '{failure_context.get('failed_task')}' is not a fixable failure"
+        )
+        return
+    
+    if _is_duplicate_build(build_id):
+        pending = _in_flight.get(build_id)
+        if pending is not None:
+            logging.info(f"Build {build_id} is already being processed - waiting for it")
+            await asyncio.wait({pending})
+        else:
+            logging.info(f"Build {build_id} was processed recently - skipping")
+        return
+    
+    task = asyncio.create_task(heal_failure(failure_context))
+    _in_flight[build_id] = task
+    try:
+        action_result = await task
+    finally:
+        del _in_flight[build_id]
+    
+    # Errors are not remembered, so a redelivery or retried webhook for
+    # this build gets another attempt
+    if action_result.get('action') == 'ERROR':
+        return
+    
+    _recent_results[build_id] = (time.monotonic() + RESULT_CACHE_TTL, action_result)
+    _recent_results.move_to_end(build_id)
+    if len(_recent_results) > RESULT_CACHE_MAX:
+        _recent_results.popitem(last=False)
+
+
+def _is_duplicate_build(build_id) -> bool:
+    """True if this worker is processing or has recently processed build_id"""
+    if build_id in _in_flight:
+        return True
+    entry = _recent_results.get(build_id)
+    return entry is not None and entry[0] > time.monotonic()
+
+
+async def heal_failure(failure_context: dict) -> dict:
+    """
+    Gather context, analyze and remediate a single failure.
+    Returns the remediation action result.
+    """
+    # Step 1: Gather context (logs, PR diff, etc.)
+    logging.info("Gathering failure context...")
+    context = await gather_failure_context(failure_context)
+    
+    # Warm up the remediation clients while the model is thinking
+    warmup_task = asyncio.create_task(prepare_remediation_clients(context))
+    
+    # Step 2: Analyze with AI
+    logging.info("Analyzing failure with OpenAI...")
+    rca_result = await analyze_with_ai(context)
+    
+    # Step 3: Take action based on confidence
+    logging.info("Executing remediation...")
+    await warmup_task
+    action_result = await execute_remediation(rca_result, context)
+    
+    logging.info(
+        f"Processing complete: {action_result.get('action')} "
+        f"(category: {rca_result.get('category')}, confidence: {rca_result.get('confidence')})"
+    )
+    return action_result
+
+
 ################################################################################
 # Helper Functions
 ################################################################################
 
+def should_deep_analyze(failure_info: dict) -> bool:
+    """
+    Cheap pre-check on the webhook fields so obviously unfixable failures
+    skip the ADO context fetches and the OpenAI call
+    """
+    names = ' '.join(
+        failure_info.get(key) or ''
+        for key in ('failed_task', 'failed_job', 'failed_stage')
+    )
+    return _SKIP_FAILURE_RE.search(names) is None
+
+
 async def gather_failure_context(failure_info: dict) -> dict:
     """
     Gather all relevant context about the failure:
@@ -119,10 +317,8 @@ async def gather_failure_context(failure_info: dict) -> dict:
     - PR changes (if applicable)
     - Pipeline YAML
     """
-    from shared.ado_client import AzureDevOpsClient
-    
     try:
-        ado_client = AzureDevOpsClient()
+        ado_client = get_ado_client()
         
         project = failure_info['project_name']
         build_id = failure_info['build_id']
@@ -135,26 +331,32 @@ async def gather_failure_context(failure_info: dict) -> dict:
             "pipeline_yaml": None
         }
         
+        # The fetches are independent, so issue them concurrently. Azure
+        # DevOps has no $batch endpoint for build or git reads (only work
+        # item tracking has one), so they can't be folded into one request.
+        fetches = {}
+        
         # Get current build logs
         logging.info(f"Fetching build logs for build {build_id}...")
-        context["build_logs"] = await ado_client.get_build_logs(project, build_id)
+        fetches["build_logs"] = ado_client.get_build_logs(project, build_id)
         
         # Get last successful build logs for comparison
         if failure_info.get('pipeline_id'):
             logging.info("Fetching last successful build logs...")
-            context["last_success_logs"] = await ado_client.get_last_successful_build_logs(
-                project,
-                failure_info['pipeline_id'],
-                failure_info.get('source_branch', 'refs/heads/main')
+            pipeline_id = failure_info['pipeline_id']
+            branch = failure_info.get('source_branch', 'refs/heads/main')
+            fetches["last_success_logs"] = _cached_fetch(
+                ('last_success_logs', project, pipeline_id, branch),
+                lambda: ado_client.get_last_successful_build_logs(project, pipeline_id, branch)
             )
         
         # Get PR changes if this is a PR build
         if failure_info.get('pr_id'):
-            logging.info(f"Fetching PR changes for PR {failure_info['pr_id']}...")
-            # Extract repo ID from URL
-            repo_id = failure_info['repo_url'].split('/')[-1] if failure_info.get('repo_url') else None
+            # Repo ID parsed from repo_url by HandleFailure
+            repo_id = failure_info.get('repo_id')
             if repo_id:
-                context["pr_changes"] = await ado_client.get_pr_changes(
+                logging.info(f"Fetching PR changes for PR {failure_info['pr_id']}...")
+                fetches["pr_changes"] = ado_client.get_pr_changes(
                     project,
                     repo_id,
                     failure_info['pr_id']
@@ -162,11 +364,20 @@ async def gather_failure_context(failure_info: dict) -> dict:
         
         # Get pipeline YAML (for YAML syntax errors)
         logging.info("Fetching pipeline definition...")
-        context["pipeline_yaml"] = await ado_client.get_pipeline_yaml(
-            project,
-            failure_info.get('pipeline_id')
+        fetches["pipeline_yaml"] = _cached_fetch(
+            ('pipeline_yaml', project, failure_info.get('pipeline_id')),
+            lambda: ado_client.get_pipeline_yaml(project, failure_info.get('pipeline_id'))
         )
         
+        results = await asyncio.gather(*fetches.values(), return_exceptions=True)
+        
+        # A failed fetch leaves its entry as None rather than losing the rest
+        for key, result in zip(fetches, results):
+            if isinstance(result, Exception):
+                logging.error(f"Error fetching {key}: {str(result)}")
+            else:
+                context[key] = result
+        
         return context
         
     except Exception as e:
@@ -178,34 +389,113 @@ async def gather_failure_context(failure_info: dict) -> dict:
         }
 
 
+async def _cached_fetch(key: tuple, fetch):
+    """
+    Return the cached result for key, awaiting fetch() on a miss.
+    Concurrent misses for the same key share a single fetch, and empty
+    results (the ADO client's error value) are not cached.
+    """
+    entry = _context_cache.get(key)
+    if entry and entry[0] > time.monotonic():
+        return _cache_value(entry)
+    
+    lock = _context_cache_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        # Another request may have filled it while we waited
+        entry = _context_cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            return _cache_value(entry)
+        
+        try:
+            value = await fetch()
+        finally:
+            _context_cache_locks.pop(key, None)
+        
+        if value:
+            if isinstance(value, str):
+                stored = (zlib.compress(value.encode('utf-8'), 1), True)
+            else:
+                stored = (value, False)
+            _context_cache[key] = (time.monotonic() + CONTEXT_CACHE_TTL, *stored)
+            _context_cache.move_to_end(key)
+            if len(_context_cache) > CONTEXT_CACHE_MAX:
+                _context_cache.popitem(last=False)
+        return value
+
+
+def _cache_value(entry: tuple):
+    """Unpack a _context_cache entry"""
+    _, value, compressed = entry
+    return zlib.decompress(value).decode('utf-8') if compressed else value
+
+
+def _ado_repo_name(repo_url: Optional[str]) -> Optional[str]:
+    """Repository name from an Azure Repos URL, or None if it isn't one"""
+    match = _ADO_REPO_RE.search(repo_url) if repo_url else None
+    return match.group('repo') if match else None
+
+
+def truncate_logs(build_logs: str) -> str:
+    """Keep the first LOG_HEAD_CHARS and last LOG_TAIL_CHARS of long logs"""
+    if len(build_logs) <= LOG_HEAD_CHARS + LOG_TAIL_CHARS:
+        return build_logs
+    return build_logs[:LOG_HEAD_CHARS] + '\n...[truncated]...\n' + build_logs[-LOG_TAIL_CHARS:]
+
+
+def _relevant_pr_changes(pr_changes: dict, failure_kind: str) -> dict:
+    """Drop changed files that can't be related to this kind of failure"""
+    extensions = _PR_FILE_EXTENSIONS[failure_kind]
+    return {
+        **pr_changes,
+        'files_changed': [
+            change for change in pr_changes.get('files_changed', [])
+            if change['path'].lower().endswith(extensions)
+        ]
+    }
+
+
+def classify_failure(build_logs: str) -> Optional[str]:
+    """
+    Route a log to an analyzer in a single scan.
+    Returns 'terraform', 'yaml', or None; Terraform wins whenever both match.
+    """
+    failure_kind = None
+    for match in _FAILURE_KIND_RE.finditer(build_logs):
+        failure_kind = match.lastgroup
+        if failure_kind == 'terraform':
+            break
+    return failure_kind
+
+
 async def analyze_with_ai(context: dict) -> dict:
     """
     Use OpenAI to analyze the failure and determine root cause
     """
-    from shared.openai_client import OpenAIClient
-    from analyzers.terraform_analyzer import is_terraform_failure, extract_terraform_error
-    from analyzers.pipeline_analyzer import is_pipeline_yaml_failure
-    
     try:
-        openai_client = OpenAIClient()
+        openai_client = get_openai_client()
         
         # Quick classification: What type of failure is this?
-        build_logs = context.get('build_logs', '')
+        build_logs = context.get('build_logs') or ''
+        failure_kind = classify_failure(build_logs)
+        
+        if context.get('pr_changes') and failure_kind in _PR_FILE_EXTENSIONS:
+            context = {**context, 'pr_changes': _relevant_pr_changes(context['pr_changes'], failure_kind)}
         
-        if is_terraform_failure(build_logs):
+        if failure_kind == 'terraform':
+            # Full logs: the Terraform analyzer picks its own window around the error
             logging.info("Detected Terraform failure")
-            from analyzers.terraform_analyzer import analyze_terraform_failure
             return await analyze_terraform_failure(context, openai_client)
         
-        elif is_pipeline_yaml_failure(build_logs):
+        truncated_context = {**context, 'build_logs': truncate_logs(build_logs)}
+        
+        if failure_kind == 'yaml':
             logging.info("Detected Pipeline YAML failure")
-            from analyzers.pipeline_analyzer import analyze_yaml_failure
-            return await analyze_yaml_failure(context, openai_client)
+            return await analyze_yaml_failure(truncated_context, openai_client)
         
         else:
             # Generic analysis for unknown failure types
             logging.info("Performing generic failure analysis")
-            return await generic_analysis(context, openai_client)
+            return await generic_analysis(truncated_context, openai_client)
         
     except Exception as e:
         logging.error(f"Error in AI analysis: {str(e)}")
@@ -224,7 +514,7 @@ async def generic_analysis(context: dict, openai_client) -> dict:
     build_logs = context.get('build_logs', '')
     
     # Simple pattern matching for now
-    if 'error' in build_logs.lower() or 'failed' in build_logs.lower():
+    if _GENERIC_ERROR_RE.search(build_logs):
         return {
             "category": "UNKNOWN_ERROR",
             "confidence": 0.3,
@@ -241,6 +531,25 @@ async def generic_analysis(context: dict, openai_client) -> dict:
     }
 
 
+async def prepare_remediation_clients(failure_context: dict) -> None:
+    """
+    Construct the cached clients execute_remediation will need, off the
+    event loop, so their connection setup overlaps with the AI analysis.
+    Failures are only logged; execute_remediation retries and surfaces them.
+    """
+    def build() -> None:
+        _warm_ado_client()
+        
+        repo_url = failure_context.get('repo_url', '')
+        if not repo_url or 'github.com' in repo_url.lower():
+            try:
+                _get_github()
+            except Exception as e:
+                logging.warning(f"Could not prepare GitHub client: {str(e)}")
+    
+    await asyncio.to_thread(build)
+
+
 async def execute_remediation(rca_result: dict, failure_context: dict) -> dict:
     """
     Execute remediation based on RCA results:
@@ -248,9 +557,6 @@ async def execute_remediation(rca_result: dict, failure_context: dict) -> dict:
     - MEDIUM confidence (65-80%): Create PR with suggestions
     - Everything else: Post detailed comment or create work item
     """
-    import os
-    from shared.ado_client import AzureDevOpsClient
-    
     try:
         confidence = rca_result.get('confidence', 0.0)
         can_autofix = rca_result.get('can_autofix', False)
@@ -258,278 +564,363 @@ async def execute_remediation(rca_result: dict, failure_context: dict) -> dict:
         
         logging.info(f"Remediation decision: confidence={confidence}, can_autofix={can_autofix}, category={category}")
         
-        # Skip if analysis failed or very low confidence
-        if confidence < 0.5:
-            logging.warning(f"Confidence too low ({confidence:.2f}) - skipping remediation")
+        band = _confidence_band(confidence, can_autofix)
+        provider = _repo_provider(failure_context) if band == 'high' else None
+        return await _REMEDIATION_POLICY[(band, provider)](rca_result, failure_context)
+    
+    except Exception as e:
+        logging.error(f"Error in remediation: {str(e)}")
+        logging.error(traceback.format_exc())
+        return {
+            "action": "ERROR",
+            "details": str(e)
+        }
+
+
+def _confidence_band(confidence: float, can_autofix: bool) -> str:
+    """'low' skips, 'high' tries a fix PR, 'mid' falls back to manual follow-up"""
+    if confidence < 0.5:
+        return 'low'
+    if confidence >= 0.65 and can_autofix:
+        return 'high'
+    return 'mid'
+
+
+def _repo_provider(failure_context: dict) -> str:
+    """'github' (the default when no URL is known) or 'azure_repos'"""
+    repo_url = failure_context.get('repo_url', '')
+    if repo_url and 'github.com' not in repo_url.lower():
+        return 'azure_repos'
+    return 'github'
+
+
+async def _skip_remediation(rca_result: dict, failure_context: dict) -> dict:
+    """Skip if analysis failed or very low confidence"""
+    confidence = rca_result.get('confidence', 0.0)
+    logging.warning(f"Confidence too low ({confidence:.2f}) - skipping remediation")
+    return {
+        "action": "SKIPPED",
+        "details": f"Analysis confidence too low ({confidence * 100:.0f}%) - manual investigation required",
+        "category": rca_result.get('category', 'UNKNOWN'),
+        "note": "No action taken due to low confidence"
+    }
+
+
+def _build_file_changes(rca_result: dict, failure_context: dict) -> dict:
+    """Generate actual code (80%+) or return {} for a suggestions-only PR (65-80%)"""
+    generate_code = rca_result.get('confidence', 0.0) >= 0.70
+    
+    if not generate_code:
+        logging.info("High confidence (65-80%) - creating suggestion PR")
+        return {}  # Suggestion-only PR
+    
+    logging.info("✨ Very high confidence (80%+) - generating actual code")
+    
+    full_context = {
+        **failure_context,
+        'build_logs': failure_context.get('build_logs', ''),  # ← Use failure_context
+        'last_successful_build_logs': failure_context.get('last_successful_build_logs', ''),
+        'pipeline_definition': failure_context.get('pipeline_definition', {})
+    }
+    file_changes = generate_terraform_fix(rca_result, full_context) 
+    
+    if not file_changes:
+        logging.warning("Code generation not implemented for this pattern - using suggestions")
+        return {}
+    
+    logging.info(f"Generated {len(file_changes)} file change(s)")
+    return file_changes
+
+
+async def _github_fix_pr(rca_result: dict, failure_context: dict) -> dict:
+    """HIGH confidence + can autofix on GitHub: open a fix PR, work item on failure"""
+    category = rca_result.get('category', 'UNKNOWN')
+    file_changes = _build_file_changes(rca_result, failure_context)
+    repo_url = failure_context.get('repo_url', '')
+    
+    try:
+        github_ops = _get_github()
+        
+        # Get repo details
+        repo_owner = os.getenv("GITHUB_REPO_OWNER", "opscart")
+        repo_name = os.getenv("GITHUB_REPO_NAME", "agentic-devops-healing")
+        
+        if repo_url:
+            extracted_owner, extracted_repo = github_ops.get_repo_from_url(repo_url)
+            if extracted_owner and extracted_repo:
+                repo_owner = extracted_owner
+                repo_name = extracted_repo
+        
+        # Get source branch
+        source_branch = failure_context.get('source_branch', 'main')
+        if source_branch and source_branch.startswith('refs/heads/'):
+            source_branch = source_branch.replace('refs/heads/', '')
+        if not source_branch:
+            source_branch = 'main'
+        
+        logging.info(f"🔧 Creating GitHub PR for {repo_owner}/{repo_name}, branch: {source_branch}")
+        
+        # Create the PR with file changes (empty dict = suggestions only)
+        pr_result = await github_ops.create_fix_pr(
+            repo_owner=repo_owner,
+            repo_name=repo_name,
+            source_branch=source_branch,
+            fix_description=rca_result.get('explanation', 'Auto-generated fix'),
+            file_changes=file_changes,  # ← Contains actual code if confidence >= 80%
+            rca=rca_result
+        )
+        
+        pr_url = pr_result.get('pr_url', 'PR created')
+        pr_number = pr_result.get('pr_id', 'N/A')
+        pr_status = pr_result.get('status', 'created')
+        
+        # Check if it was a duplicate
+        if pr_status == 'duplicate_prevented':
+            logging.info(f"Found existing GitHub PR #{pr_number}: {pr_url}")
             return {
-                "action": "SKIPPED",
-                "details": f"Analysis confidence too low ({confidence * 100:.0f}%) - manual investigation required",
-                "category": category,
-                "note": "No action taken due to low confidence"
+                "action": "EXISTING_PR_FOUND",
+                "details": f"Found existing GitHub PR #{pr_number}",
+                "pr_url": pr_url,
+                "pr_number": pr_number
             }
         
-        ado_client = AzureDevOpsClient()
+        # The generated fix is already on the base branch
+        if pr_status == 'no_changes_needed':
+            logging.info(f"Fix already present on {source_branch} - no PR created")
+            return {
+                "action": "NO_CHANGES_NEEDED",
+                "details": f"Generated fix is already on {source_branch} - no PR created",
+                "category": category
+            }
         
-        # HIGH confidence + can autofix = Try to create PR
-        if confidence >= 0.65 and can_autofix:
-            
-            # Determine if we should generate actual code (80%+) or just suggestions (65-80%)
-            generate_code = confidence >= 0.70
-            
-            if generate_code:
-                logging.info("✨ Very high confidence (80%+) - generating actual code")
-                from shared.code_generator import generate_terraform_fix
-                
-                full_context = {
-                    **failure_context,
-                    'build_logs': failure_context.get('build_logs', ''),  # ← Use failure_context
-                    'last_successful_build_logs': failure_context.get('last_successful_build_logs', ''),
-                    'pipeline_definition': failure_context.get('pipeline_definition', {})
-                }
-                file_changes = generate_terraform_fix(rca_result, full_context) 
-                
-                if not file_changes:
-                    logging.warning("Code generation not implemented for this pattern - using suggestions")
-                    file_changes = {}
-                else:
-                    logging.info(f"Generated {len(file_changes)} file change(s)")
-            else:
-                logging.info("High confidence (65-80%) - creating suggestion PR")
-                file_changes = {}  # Suggestion-only PR
-            
-            # Determine repository platform
-            repo_url = failure_context.get('repo_url', '')
-            is_github = True  # Default to GitHub
-            if repo_url:
-                is_github = 'github.com' in repo_url.lower()
-            
-            if is_github:
-                # ============================================
-                # GitHub PR Creation
-                # ============================================
-                try:
-                    from shared.github_operations import GitHubOperations
-                    github_ops = GitHubOperations()
-                    
-                    # Get repo details
-                    repo_owner = os.getenv("GITHUB_REPO_OWNER", "opscart")
-                    repo_name = os.getenv("GITHUB_REPO_NAME", "agentic-devops-healing")
-                    
-                    if repo_url:
-                        extracted_owner, extracted_repo = github_ops.get_repo_from_url(repo_url)
-                        if extracted_owner and extracted_repo:
-                            repo_owner = extracted_owner
-                            repo_name = extracted_repo
-                    
-                    # Get source branch
-                    source_branch = failure_context.get('source_branch', 'main')
-                    if source_branch and source_branch.startswith('refs/heads/'):
-                        source_branch = source_branch.replace('refs/heads/', '')
-                    if not source_branch:
-                        source_branch = 'main'
-                    
-                    logging.info(f"🔧 Creating GitHub PR for {repo_owner}/{repo_name}, branch: {source_branch}")
-                    
-                    # Create the PR with file changes (empty dict = suggestions only)
-                    pr_result = await github_ops.create_fix_pr(
-                        repo_owner=repo_owner,
-                        repo_name=repo_name,
-                        source_branch=source_branch,
-                        fix_description=rca_result.get('explanation', 'Auto-generated fix'),
-                        file_changes=file_changes,  # ← Contains actual code if confidence >= 80%
-                        rca=rca_result
-                    )
-                    
-                    pr_url = pr_result.get('pr_url', 'PR created')
-                    pr_number = pr_result.get('pr_id', 'N/A')
-                    pr_status = pr_result.get('status', 'created')
-                    
-                    # Check if it was a duplicate
-                    if pr_status == 'duplicate_prevented':
-                        logging.info(f"Found existing GitHub PR #{pr_number}: {pr_url}")
-                        return {
-                            "action": "EXISTING_PR_FOUND",
-                            "details": f"Found existing GitHub PR #{pr_number}",
-                            "pr_url": pr_url,
-                            "pr_number": pr_number
-                        }
-                    else:
-                        logging.info(f"GitHub PR #{pr_number} created: {pr_url}")
-                        
-                        return {
-                            "action": "AUTO_FIX_PR_CREATED",
-                            "details": f"Created GitHub PR #{pr_number}" + (
-                                " with code changes" if file_changes else " with fix suggestions"
-                            ),
-                            "pr_url": pr_url,
-                            "pr_number": pr_number,
-                            "has_code_changes": bool(file_changes)
-                        }
-                
-                except Exception as pr_error:
-                    logging.error(f"GitHub PR creation failed: {str(pr_error)}")
-                    import traceback
-                    logging.error(traceback.format_exc())
-                    
-                    # Fallback to work item
-                    work_item_id = await ado_client.create_work_item(
-                        project=failure_context.get('project_name', 'AI-DevOps-POC'),
-                        title=f"🤖 Auto-fix Suggested: {category.replace('_', ' ').title()}",
-                        description=f"PR creation failed: {str(pr_error)}\n\n{format_work_item_description(rca_result, failure_context)}"
-                    )
-                    
-                    return {
-                        "action": "AUTO_FIX_SUGGESTED",
-                        "details": f"Created work item: {work_item_id} (PR failed: {str(pr_error)})",
-                        "work_item_id": work_item_id
-                    }
+        logging.info(f"GitHub PR #{pr_number} created: {pr_url}")
+        
+        return {
+            "action": "AUTO_FIX_PR_CREATED",
+            "details": f"Created GitHub PR #{pr_number}" + (
+                " with code changes" if file_changes else " with fix suggestions"
+            ),
+            "pr_url": pr_url,
+            "pr_number": pr_number,
+            "has_code_changes": bool(file_changes)
+        }
+    
+    except Exception as pr_error:
+        logging.error(f"GitHub PR creation failed: {str(pr_error)}")
+        logging.error(traceback.format_exc())
+        
+        # Fallback to work item
+        work_item_id = await get_ado_client().create_work_item(
+            project=failure_context.get('project_name', 'AI-DevOps-POC'),
+            title=f"🤖 Auto-fix Suggested: {category.replace('_', ' ').title()}",
+            description=f"PR creation failed: {str(pr_error)}\n\n{format_work_item_description(rca_result, failure_context)}"
+        )
+        
+        return {
+            "action": "AUTO_FIX_SUGGESTED",
+            "details": f"Created work item: {work_item_id} (PR failed: {str(pr_error)})",
+            "work_item_id": work_item_id
+        }
+
+
+async def _azure_repos_fix_pr(rca_result: dict, failure_context: dict) -> dict:
+    """HIGH confidence + can autofix on Azure Repos: open a fix PR, work item on failure"""
+    file_changes = _build_file_changes(rca_result, failure_context)
+    
+    try:
+        git_ops = _get_git_ops()
+        
+        repo_name = failure_context.get('repo_id') or "agentic-devops-healing"
+        
+        source_branch = failure_context.get('source_branch', 'refs/heads/main')
+        if not source_branch.startswith('refs/heads/'):
+            source_branch = f'refs/heads/{source_branch}'
+        
+        pr_result = await git_ops.create_fix_pr(
+            project=failure_context.get('project_name', 'AI-DevOps-POC'),
+            repo_name=repo_name,
+            source_branch=source_branch,
+            fix_description=rca_result.get('explanation', ''),
+            file_changes=file_changes,
+            rca=rca_result
+        )
+        
+        return {
+            "action": "AUTO_FIX_PR_CREATED",
+            "details": f"Created Azure Repos PR",
+            "pr_url": pr_result.get('pr_url'),
+            "has_code_changes": bool(file_changes)
+        }
+    
+    except Exception as pr_error:
+        logging.error(f"Azure PR creation failed: {str(pr_error)}")
+        
+        work_item_id = await get_ado_client().create_work_item(
+            project=failure_context.get('project_name', 'AI-DevOps-POC'),
+            title=f"Pipeline Failure: {failure_context.get('failed_stage', 'Unknown')}",
+            description=format_work_item_description(rca_result, failure_context)
+        )
+        
+        return {
+            "action": "WORK_ITEM_CREATED",
+            "details": f"Created work item: {work_item_id} (PR failed)",
+            "work_item_id": work_item_id
+        }
+
+
+async def _manual_remediation(rca_result: dict, failure_context: dict) -> dict:
+    """MEDIUM/LOW confidence or can't autofix = Create work item"""
+    confidence = rca_result.get('confidence', 0.0)
+    can_autofix = rca_result.get('can_autofix', False)
+    category = rca_result.get('category', 'UNKNOWN')
+    
+    # For syntax errors with high confidence, create PR with suggestions
+    if category == 'TERRAFORM_SYNTAX_ERROR' and confidence >= 0.80:
+        logging.info(f"Creating suggestion PR for syntax error (confidence: {confidence:.2f})")
+        
+        # GitHub PR with suggestions only (no file changes)
+        try:
+            github_ops = _get_github()
             
-            else:
-                # ============================================
-                # Azure Repos PR Creation
-                # ============================================
-                try:
-                    from shared.git_operations import GitOperations
-                    git_ops = GitOperations()
-                    
-                    repo_name = "agentic-devops-healing"
-                    if repo_url and '/_git/' in repo_url:
-                        repo_name = repo_url.split('/_git/')[-1].split('?')[0].strip('/')
-                    
-                    source_branch = failure_context.get('source_branch', 'refs/heads/main')
-                    if not source_branch.startswith('refs/heads/'):
-                        source_branch = f'refs/heads/{source_branch}'
-                    
-                    pr_result = await git_ops.create_fix_pr(
-                        project=failure_context.get('project_name', 'AI-DevOps-POC'),
-                        repo_name=repo_name,
-                        source_branch=source_branch,
-                        fix_description=rca_result.get('explanation', ''),
-                        file_changes=file_changes,
-                        rca=rca_result
-                    )
-                    
-                    return {
-                        "action": "AUTO_FIX_PR_CREATED",
-                        "details": f"Created Azure Repos PR",
-                        "pr_url": pr_result.get('pr_url'),
-                        "has_code_changes": bool(file_changes)
-                    }
-                
-                except Exception as pr_error:
-                    logging.error(f"Azure PR creation failed: {str(pr_error)}")
-                    
-                    work_item_id = await ado_client.create_work_item(
-                        project=failure_context.get('project_name', 'AI-DevOps-POC'),
-                        title=f"Pipeline Failure: {failure_context.get('failed_stage', 'Unknown')}",
-                        description=format_work_item_description(rca_result, failure_context)
-                    )
-                    
-                    return {
-                        "action": "WORK_ITEM_CREATED",
-                        "details": f"Created work item: {work_item_id} (PR failed)",
-                        "work_item_id": work_item_id
-                    }
-        
-        # MEDIUM/LOW confidence or can't autofix = Create work item
-        else:
-            # For syntax errors with high confidence, create PR with suggestions
-            if category == 'TERRAFORM_SYNTAX_ERROR' and confidence >= 0.80:
-                logging.info(f"Creating suggestion PR for syntax error (confidence: {confidence:.2f})")
-                
-                # GitHub PR with suggestions only (no file changes)
-                try:
-                    from shared.github_operations import GitHubOperations
-                    github_ops = GitHubOperations()
-                    
-                    repo_owner = os.getenv("GITHUB_REPO_OWNER", "opscart")
-                    repo_name = os.getenv("GITHUB_REPO_NAME", "agentic-devops-healing")
-                    source_branch = failure_context.get('source_branch', 'main')
-                    
-                    if source_branch and source_branch.startswith('refs/heads/'):
-                        source_branch = source_branch.replace('refs/heads/', '')
-                    if not source_branch:
-                        source_branch = 'main'
-                    
-                    # Create PR with empty file_changes (suggestions only)
-                    pr_result = await github_ops.create_fix_pr(
-                        repo_owner=repo_owner,
-                        repo_name=repo_name,
-                        source_branch=source_branch,
-                        fix_description=rca_result.get('explanation', 'Manual fix required'),
-                        file_changes={},  # Empty = suggestions only
-                        rca=rca_result
-                    )
-                    
-                    return {
-                        "action": "MANUAL_FIX_SUGGESTED",
-                        "details": f"Created PR #{pr_result.get('pr_id')} with fix suggestions (manual implementation required)",
-                        "pr_url": pr_result.get('pr_url')
-                    }
-                
-                except Exception as e:
-                    logging.error(f"PR creation failed for syntax error: {str(e)}")
-                    # Fall through to create work item
+            repo_owner = os.getenv("GITHUB_REPO_OWNER", "opscart")
+            repo_name = os.getenv("GITHUB_REPO_NAME", "agentic-devops-healing")
+            source_branch = failure_context.get('source_branch', 'main')
             
-            # Create work item (default for low confidence or if PR fails)
-            logging.info(f"Creating work item (confidence: {confidence:.2f}, can_autofix: {can_autofix})")
+            if source_branch and source_branch.startswith('refs/heads/'):
+                source_branch = source_branch.replace('refs/heads/', '')
+            if not source_branch:
+                source_branch = 'main'
             
-            work_item_id = await ado_client.create_work_item(
-                project=failure_context.get('project_name', 'AI-DevOps-POC'),
-                title=f"Pipeline Failure: {failure_context.get('failed_stage', 'Unknown')}",
-                description=format_work_item_description(rca_result, failure_context)
+            # Create PR with empty file_changes (suggestions only)
+            pr_result = await github_ops.create_fix_pr(
+                repo_owner=repo_owner,
+                repo_name=repo_name,
+                source_branch=source_branch,
+                fix_description=rca_result.get('explanation', 'Manual fix required'),
+                file_changes={},  # Empty = suggestions only
+                rca=rca_result
             )
+            
             return {
-                "action": "WORK_ITEM_CREATED",
-                "details": f"Created work item: {work_item_id}",
-                "work_item_id": work_item_id
+                "action": "MANUAL_FIX_SUGGESTED",
+                "details": f"Created PR #{pr_result.get('pr_id')} with fix suggestions (manual implementation required)",
+                "pr_url": pr_result.get('pr_url')
             }
+        
+        except Exception as e:
+            logging.error(f"PR creation failed for syntax error: {str(e)}")
+            # Fall through to create work item
     
-    except Exception as e:
-        logging.error(f"Error in remediation: {str(e)}")
-        import traceback
-        logging.error(traceback.format_exc())
-        return {
-            "action": "ERROR",
-            "details": str(e)
-        }
-def format_rca_comment(rca_result: dict) -> str:
-    """Format RCA results as Markdown comment"""
-    return f"""
+    # Create work item (default for low confidence or if PR fails)
+    logging.info(f"Creating work item (confidence: {confidence:.2f}, can_autofix: {can_autofix})")
+    
+    work_item_id = await get_ado_client().create_work_item(
+        project=failure_context.get('project_name', 'AI-DevOps-POC'),
+        title=f"Pipeline Failure: {failure_context.get('failed_stage', 'Unknown')}",
+        description=format_work_item_description(rca_result, failure_context)
+    )
+    return {
+        "action": "WORK_ITEM_CREATED",
+        "details": f"Created work item: {work_item_id}",
+        "work_item_id": work_item_id
+    }
+
+
+# (confidence band, repo provider) -> remediation handler
+_REMEDIATION_POLICY = {
+    ('low', None): _skip_remediation,
+    ('mid', None): _manual_remediation,
+    ('high', 'github'): _github_fix_pr,
+    ('high', 'azure_repos'): _azure_repos_fix_pr,
+}
+
+
+# Comment templates, filled with format_map; each field falls back to its
+# default when the source dict doesn't have it
+_RCA_COMMENT_TEMPLATE = """
 ## AI Root Cause Analysis
 
-**Failure Category:** `{rca_result.get('category', 'UNKNOWN')}`  
-**Confidence:** `{rca_result.get('confidence', 0.0):.0%}`
+**Failure Category:** `{category}`  
+**Confidence:** `{confidence:.0%}`
 
 ### Analysis
-{rca_result.get('explanation', 'No explanation available')}
+{explanation}
 
 ### Suggested Fix
-{rca_result.get('suggested_fix', 'Manual review required')}
+{suggested_fix}
 
 ---
 *Analyzed by Agentic DevOps Healer v0.1*
 """
 
+_RCA_COMMENT_DEFAULTS = {
+    'category': 'UNKNOWN',
+    'confidence': 0.0,
+    'explanation': 'No explanation available',
+    'suggested_fix': 'Manual review required',
+}
 
-def format_work_item_description(rca_result: dict, failure_context: dict) -> str:
-    """Format work item description"""
-    return f"""
+_WORK_ITEM_TEMPLATE = """
 ## Pipeline Failure Analysis
 
-**Build:** {failure_context.get('build_number', 'Unknown')}  
-**Stage:** {failure_context.get('failed_stage', 'Unknown')}  
-**Job:** {failure_context.get('failed_job', 'Unknown')}
+**Build:** {build_number}  
+**Stage:** {failed_stage}  
+**Job:** {failed_job}
 
 ## AI Analysis
-**Category:** {rca_result.get('category', 'UNKNOWN')}  
-**Confidence:** {rca_result.get('confidence', 0.0):.0%}
+**Category:** {category}  
+**Confidence:** {confidence:.0%}
 
-{rca_result.get('explanation', 'No explanation available')}
+{explanation}
 
 ## Suggested Action
-{rca_result.get('suggested_fix', 'Manual investigation required')}
+{suggested_fix}
 
 ## Build Link
-{failure_context.get('organization_url', '')}/{failure_context.get('project_name', '')}/_build/results?buildId={failure_context.get('build_id', '')}
-"""
\ No newline at end of file
+{organization_url}/{project_name}/_build/results?buildId={build_id}
+"""
+
+# Work item fields come from the failure context and from the RCA result
+_WORK_ITEM_CONTEXT_DEFAULTS = {
+    'build_number': 'Unknown',
+    'failed_stage': 'Unknown',
+    'failed_job': 'Unknown',
+    'organization_url': '',
+    'project_name': '',
+    'build_id': '',
+}
+
+_WORK_ITEM_RCA_DEFAULTS = {
+    'category': 'UNKNOWN',
+    'confidence': 0.0,
+    'explanation': 'No explanation available',
+    'suggested_fix': 'Manual investigation required',
+}
+
+_WORK_ITEM_FIELDS = (*_WORK_ITEM_CONTEXT_DEFAULTS, *_WORK_ITEM_RCA_DEFAULTS)
+
+
+def format_rca_comment(rca_result: dict) -> str:
+    """Format RCA results as Markdown comment"""
+    return _render_rca_comment(
+        *(rca_result.get(k, default) for k, default in _RCA_COMMENT_DEFAULTS.items())
+    )
+
+
+def format_work_item_description(rca_result: dict, failure_context: dict) -> str:
+    """Format work item description"""
+    return _render_work_item(
+        *(failure_context.get(k, default) for k, default in _WORK_ITEM_CONTEXT_DEFAULTS.items()),
+        *(rca_result.get(k, default) for k, default in _WORK_ITEM_RCA_DEFAULTS.items())
+    )
+
+
+# Retried webhooks render the same values again, so keep recent renders
+@lru_cache(maxsize=256)
+def _render_rca_comment(*values) -> str:
+    return _RCA_COMMENT_TEMPLATE.format_map(dict(zip(_RCA_COMMENT_DEFAULTS, values)))
+
+
+@lru_cache(maxsize=256)
+def _render_work_item(*values) -> str:
+    return _WORK_ITEM_TEMPLATE.format_map(dict(zip(_WORK_ITEM_FIELDS, values)))
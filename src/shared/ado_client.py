@@ -4,11 +4,30 @@ Handles all interactions with Azure DevOps REST API
 """
 
 import os
+import asyncio
+import functools
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict, List
 from azure.devops.connection import Connection
 from msrest.authentication import BasicAuthentication
 
+# Oversized build logs keep their start (agent/job setup) and their end,
+# where the failing step reports, and drop the middle
+LOG_HEAD_CHARS = 64 * 1024
+LOG_TAIL_CHARS = 512 * 1024
+
+# Only the most recent PR commits are useful context for a failure
+PR_MAX_COMMITS = 10
+
+# Threads for the blocking azure-devops SDK calls
+ADO_MAX_WORKERS = 16
+
+# project -> work item type used for failures; Agile/Basic processes have no Bug
+_work_item_types: Dict[str, str] = {}
+
 
 class AzureDevOpsClient:
     """Client for Azure DevOps operations"""
@@ -26,37 +45,40 @@ class AzureDevOpsClient:
         self.build_client = self.connection.clients.get_build_client()
         self.git_client = self.connection.clients.get_git_client()
         self.work_item_client = self.connection.clients.get_work_item_tracking_client()
+        
+        # msrest closes its (per-thread) requests session after failed or
+        # non-streamed calls unless keep_alive is set; keep connections warm
+        for client in (self.build_client, self.git_client, self.work_item_client):
+            client.config.keep_alive = True
+        
+        # The SDK is synchronous; its calls run here instead of on the event loop
+        self._executor = ThreadPoolExecutor(max_workers=ADO_MAX_WORKERS, thread_name_prefix="ado")
+    
+    async def _call(self, fn, *args, **kwargs):
+        """Run a blocking SDK call on the client's thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
     
     async def get_build_logs(self, project: str, build_id: int) -> str:
         """Fetch complete build logs"""
         try:
-            logs = self.build_client.get_build_logs(project, build_id)
+            logs = await self._call(self.build_client.get_build_logs, project, build_id)
+            
+            # Each log is fetched on the thread pool so they are all in
+            # flight at once
+            results = await asyncio.gather(
+                *(self._call(self._read_build_log, project, build_id, log.id) for log in logs),
+                return_exceptions=True
+            )
             
             full_log = []
-            for log in logs:
-                try:
-                    log_content = self.build_client.get_build_log(
-                        project, build_id, log.id
-                    )
-                    
-                    # Handle different response types
-                    if hasattr(log_content, 'read'):
-                        # File-like object
-                        content = log_content.read()
-                        if isinstance(content, bytes):
-                            content = content.decode('utf-8')
-                        full_log.append(content)
-                    elif isinstance(log_content, str):
-                        # Already a string
-                        full_log.append(log_content)
-                    else:
-                        # Generator or iterable
-                        full_log.append(''.join(str(line) for line in log_content))
-                        
-                except Exception as e:
-                    logging.warning(f"Could not fetch log {log.id}: {str(e)}")
-            
-            result = "\n".join(full_log)
+            for log, content in zip(logs, results):
+                if isinstance(content, Exception):
+                    logging.warning(f"Could not fetch log {log.id}: {str(content)}")
+                else:
+                    full_log.append(content)
+            
+            result = _bounded_join(full_log, LOG_HEAD_CHARS, LOG_TAIL_CHARS)
             logging.info(f"Fetched {len(full_log)} log entries, total length: {len(result)}")
             return result
             
@@ -64,6 +86,24 @@ class AzureDevOpsClient:
             logging.error(f"Error fetching build logs: {str(e)}")
             return ""
     
+    def _read_build_log(self, project: str, build_id: int, log_id: int) -> str:
+        """Download a single build log as text (blocking)"""
+        log_content = self.build_client.get_build_log(project, build_id, log_id)
+        
+        # Handle different response types
+        if hasattr(log_content, 'read'):
+            # File-like object
+            content = log_content.read()
+            if isinstance(content, bytes):
+                content = content.decode('utf-8')
+            return content
+        elif isinstance(log_content, str):
+            # Already a string
+            return log_content
+        else:
+            # Generator or iterable
+            return ''.join(str(line) for line in log_content)
+    
     async def get_last_successful_build_logs(
         self, 
         project: str, 
@@ -72,7 +112,8 @@ class AzureDevOpsClient:
     ) -> str:
         """Get logs from last successful build on same branch"""
         try:
-            builds = self.build_client.get_builds(
+            builds = await self._call(
+                self.build_client.get_builds,
                 project=project,
                 definitions=[pipeline_id],
                 branch_name=branch,
@@ -97,21 +138,23 @@ class AzureDevOpsClient:
     ) -> Dict:
         """Get PR diff and metadata"""
         try:
-            pr = self.git_client.get_pull_request(repo_id, pr_id, project)
-            
-            # Get commits
-            commits = self.git_client.get_pull_request_commits(
-                repo_id, pr_id, project
-            )
-            
-            # Get file changes
-            iterations = self.git_client.get_pull_request_iterations(
-                repo_id, pr_id, project
+            # SDK calls run on the thread pool so the other context fetches
+            # in gather_failure_context keep making progress meanwhile.
+            # The PR, its commits and its iterations are independent reads.
+            pr, commits, iterations = await asyncio.gather(
+                self._call(self.git_client.get_pull_request, repo_id, pr_id, project),
+                self._call(
+                    self.git_client.get_pull_request_commits,
+                    repo_id, pr_id, project, top=PR_MAX_COMMITS
+                ),
+                self._call(self.git_client.get_pull_request_iterations, repo_id, pr_id, project)
             )
             
+            # Get file changes from the latest iteration
             changes = []
             if iterations and len(iterations) > 0:
-                iteration_changes = self.git_client.get_pull_request_iteration_changes(
+                iteration_changes = await self._call(
+                    self.git_client.get_pull_request_iteration_changes,
                     repo_id, pr_id, iterations[-1].id, project
                 )
                 if iteration_changes and iteration_changes.change_entries:
@@ -160,7 +203,8 @@ class AzureDevOpsClient:
                 status=1  # Active
             )
             
-            self.git_client.create_thread(
+            await self._call(
+                self.git_client.create_thread,
                 comment_thread=thread,
                 repository_id=repo_id,
                 pull_request_id=pr_id,
@@ -202,15 +246,20 @@ class AzureDevOpsClient:
                 )
             ]
             
+            work_item_type = await self._work_item_type(project)
             try:
-                work_item = self.work_item_client.create_work_item(
+                work_item = await self._call(
+                    self.work_item_client.create_work_item,
                     document=document,
                     project=project,
-                    type="Bug"
+                    type=work_item_type
                 )
             except Exception as e:
-                logging.warning(f"Could not create Bug, trying Task: {str(e)}")
-                work_item = self.work_item_client.create_work_item(
+                if work_item_type == "Task":
+                    raise
+                logging.warning(f"Could not create {work_item_type}, trying Task: {str(e)}")
+                work_item = await self._call(
+                    self.work_item_client.create_work_item,
                     document=document,
                     project=project,
                     type="Task"
@@ -221,4 +270,70 @@ class AzureDevOpsClient:
             
         except Exception as e:
             logging.error(f"Error creating work item: {str(e)}")
-            return None
\ No newline at end of file
+            return None
+    
+    async def _work_item_type(self, project: str) -> str:
+        """Bug if the project's process has it, else Task (probed once per project)"""
+        work_item_type = _work_item_types.get(project)
+        if work_item_type:
+            return work_item_type
+        
+        try:
+            types = await self._call(self.work_item_client.get_work_item_types, project)
+        except Exception as e:
+            logging.warning(f"Could not list work item types: {str(e)}")
+            return "Bug"
+        
+        names = [t.name for t in types or []]
+        if "Bug" in names:
+            work_item_type = "Bug"
+        elif "Task" in names or not names:
+            work_item_type = "Task"
+        else:
+            work_item_type = names[0]
+        
+        _work_item_types[project] = work_item_type
+        return work_item_type
+
+
+def _bounded_join(parts: List[str], head_chars: int, tail_chars: int) -> str:
+    """
+    "\n".join(parts), but only the first head_chars and last tail_chars are
+    kept when the result would be longer, without building the full string
+    """
+    total = sum(map(len, parts)) + max(len(parts) - 1, 0)
+    if total <= head_chars + tail_chars:
+        return "\n".join(parts)
+    
+    head, remaining = [], head_chars
+    for i, part in enumerate(parts):
+        piece = (part if i == 0 else "\n" + part)[:remaining]
+        head.append(piece)
+        remaining -= len(piece)
+        if remaining <= 0:
+            break
+    
+    tail, remaining = deque(), tail_chars
+    for i in range(len(parts) - 1, -1, -1):
+        piece = (parts[i] if i == 0 else "\n" + parts[i])[-remaining:]
+        tail.appendleft(piece)
+        remaining -= len(piece)
+        if remaining <= 0:
+            break
+    
+    return ''.join(head) + "\n...[truncated]...\n" + ''.join(tail)
+
+
+# One client per worker process, shared by every invocation
+_client: Optional[AzureDevOpsClient] = None
+_client_lock = threading.Lock()
+
+
+def get_ado_client() -> AzureDevOpsClient:
+    """Return the process-wide AzureDevOpsClient, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = AzureDevOpsClient()
+    return _client
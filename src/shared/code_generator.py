@@ -2,9 +2,105 @@
 Code generation for common Terraform patterns
 """
 
+import os
 import re
 import logging
-from collections import Counter
+import hashlib
+from collections import OrderedDict, deque
+from typing import Optional, Tuple
+
+import requests
+from github import GithubException
+
+from .github_operations import get_repo
+
+# Terraform's undeclared variable error:
+# An input variable with the name "azure_region" has not been declared
+_VAR_MSG_RE = re.compile(r'variable with the name ["\']([a-z_][a-z0-9_]*)["\']', re.IGNORECASE)
+
+# Terraform variable references (var.NAME)
+_VAR_RE = re.compile(r'var\.([a-z_][a-z0-9_]*)', re.IGNORECASE)
+
+# Terraform working directory printed by the pipeline task. These start
+# with a case-sensitive literal so the regex engine can skip ahead to it;
+# IGNORECASE would turn that fast path off.
+_WORKDIR_RE = re.compile(
+    r'Working directory:\s*/[^/]+/[^/]+/[^/]+/[^/]+/(infrastructure/[\w\-/]+)'
+)
+
+# cd $(Build.SourcesDirectory)/infrastructure/test-apps/...
+_CD_SOURCES_RE = re.compile(
+    r'cd[^\n]*?SourcesDirectory[^\n]*/?(infrastructure/test-apps/[\w\-/]+)'
+)
+
+# Any cd into the infrastructure tree (matched per line)
+_CD_INFRA_RE = re.compile(r'cd.*/?(infrastructure/[\w\-/]+)')
+
+# "east-us" was not found in the list of supported Azure Locations
+_WRONG_REGION_RE = re.compile(r'"([a-z]+-[a-z-]+)" was not found', re.IGNORECASE)
+
+# location = "east-us" in Terraform resources
+_LOCATION_ASSIGN_RE = re.compile(r'location\s*=\s*"([a-z][a-z0-9-]*)"', re.IGNORECASE)
+
+# Errors are reported near the end of the log, so scan this much of the
+# tail first and only fall back to the whole log when it has no match
+_TAIL_CHARS = 64 * 1024
+
+# Parse results keyed by a hash of the build log (never the log itself),
+# one dict of {parser: result} per log
+_PARSE_CACHE: "OrderedDict[bytes, dict]" = OrderedDict()
+_PARSE_CACHE_MAX = 32
+
+# Defaults and descriptions for commonly missing variables
+_VARIABLE_DEFAULTS = {
+    'azure_region': 'eastus',
+    'location': 'eastus',
+    'region': 'eastus',
+    'environment': 'dev',
+}
+
+_VARIABLE_DESCRIPTIONS = {
+    'azure_region': 'Azure region for resource deployment',
+    'location': 'Azure location for resources',
+    'region': 'Deployment region',
+    'environment': 'Environment name',
+}
+
+_VARIABLE_TEMPLATE = '''variable "{name}" {{
+  description = "{description}"
+  type        = string
+  default     = "{default}"
+}}
+'''
+
+
+def _tail_start(build_logs: str) -> int:
+    return max(len(build_logs) - _TAIL_CHARS, 0)
+
+
+def _search(pattern: re.Pattern, build_logs: str):
+    """pattern.search over the tail window, then over the whole log"""
+    start = _tail_start(build_logs)
+    match = pattern.search(build_logs, start)
+    if match is None and start:
+        match = pattern.search(build_logs)
+    return match
+
+
+def _memoized(parse, build_logs: str):
+    """parse(build_logs), cached on a digest of the logs so the text isn't retained"""
+    digest = hashlib.blake2b(build_logs.encode(), digest_size=16).digest()
+    results = _PARSE_CACHE.get(digest)
+    if results is None:
+        results = _PARSE_CACHE[digest] = {}
+        if len(_PARSE_CACHE) > _PARSE_CACHE_MAX:
+            _PARSE_CACHE.popitem(last=False)
+    else:
+        _PARSE_CACHE.move_to_end(digest)
+    
+    if parse not in results:
+        results[parse] = parse(build_logs)
+    return results[parse]
 
 
 def generate_terraform_fix(rca: dict, context: dict) -> dict:
@@ -25,24 +121,24 @@ def generate_terraform_fix(rca: dict, context: dict) -> dict:
 
 def extract_variable_name(build_logs: str) -> str:
     """Extract variable name from build logs"""
+    return _memoized(_extract_variable_name, build_logs)
+
+
+def _extract_variable_name(build_logs: str) -> str:
     
     # Priority 1: Look for Terraform's error message
     # "An input variable with the name "azure_region" has not been declared"
-    match = re.search(
-        r'variable with the name ["\']([a-z_][a-z0-9_]*)["\']',
-        build_logs,
-        re.IGNORECASE
-    )
+    match = _search(_VAR_MSG_RE, build_logs)
     if match:
         var_name = match.group(1)
         logging.info(f"Extracted variable from error message: {var_name}")
         return var_name
     
     # Priority 2: Look for var.VARNAME pattern
-    matches = re.findall(r'var\.([a-z_][a-z0-9_]*)', build_logs, re.IGNORECASE)
+    matches = _VAR_RE.findall(build_logs, _tail_start(build_logs)) or _VAR_RE.findall(build_logs)
     if matches:
-        # Get most common variable name
-        var_name = Counter(matches).most_common(1)[0][0]
+        # Get most common variable name (first seen wins ties)
+        var_name = max(dict.fromkeys(matches), key=matches.count)
         logging.info(f"Extracted variable from var. pattern: {var_name}")
         return var_name
     
@@ -59,45 +155,12 @@ def determine_filepath(context: dict, filename: str = 'variables.tf') -> str:
         logging.error("❌ No build logs available")
         return f"infrastructure/core/terraform/{filename}"
     
-    # Strategy 1: Look for explicit working directory output
-    # The logs show: "Working directory: /home/vsts/work/1/s/infrastructure/..."
-    match = re.search(
-        r'Working directory:\s*/[^/]+/[^/]+/[^/]+/[^/]+/(infrastructure/[\w\-/]+)',
-        build_logs,
-        re.IGNORECASE
-    )
-    if match:
-        rel_path = match.group(1)
-        filepath = f"{rel_path}/{filename}"
-        logging.info(f"✅ Extracted from 'Working directory': {filepath}")
-        return filepath
-    
-    # Strategy 2: Look for cd command to Build.SourcesDirectory
-    # Example: cd $(Build.SourcesDirectory)/infrastructure/test-apps/...
-    match = re.search(
-        r'cd.*?SourcesDirectory[^\n]*/?(infrastructure/test-apps/[\w\-/]+)',
-        build_logs,
-        re.IGNORECASE
-    )
-    if match:
-        rel_path = match.group(1)
+    rel_path, source = _memoized(_find_infrastructure_dir, build_logs)
+    if rel_path:
         filepath = f"{rel_path}/{filename}"
-        logging.info(f"✅ Extracted from cd command: {filepath}")
+        logging.info(f"✅ Extracted from {source}: {filepath}")
         return filepath
     
-    # Strategy 3: Look for terraform init/validate in specific directory
-    # Find lines with "terraform init" and extract directory from context
-    for i, line in enumerate(build_logs.split('\n')):
-        if 'terraform init' in line.lower():
-            # Look backwards for cd command
-            for prev_line in build_logs.split('\n')[max(0, i-10):i]:
-                match = re.search(r'cd.*/?(infrastructure/[\w\-/]+)', prev_line)
-                if match:
-                    rel_path = match.group(1)
-                    filepath = f"{rel_path}/{filename}"
-                    logging.info(f"✅ Extracted from terraform context: {filepath}")
-                    return filepath
-    
     # Fallback: Use failure_info if available
     failure_info = context.get('failure_info', {})
     pipeline_id = failure_info.get('pipeline_id', '')
@@ -119,6 +182,43 @@ def determine_filepath(context: dict, filename: str = 'variables.tf') -> str:
     return f"infrastructure/core/terraform/{filename}"
 
 
+def _find_infrastructure_dir(build_logs: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Terraform directory named in the build logs, and which strategy found it.
+    Called through _memoized because the variable and region fixes both look
+    it up for the same logs.
+    """
+    # Each strategy's regex only runs if its literal appears at all
+    # Strategy 1: Look for explicit working directory output
+    # The logs show: "Working directory: /home/vsts/work/1/s/infrastructure/..."
+    match = _search(_WORKDIR_RE, build_logs) if 'Working directory' in build_logs else None
+    if match:
+        return match.group(1), "'Working directory'"
+    
+    # Strategy 2: Look for cd command to Build.SourcesDirectory
+    # Example: cd $(Build.SourcesDirectory)/infrastructure/test-apps/...
+    match = _search(_CD_SOURCES_RE, build_logs) if 'SourcesDirectory' in build_logs else None
+    if match:
+        return match.group(1), "cd command"
+    
+    # Strategy 3: Look for terraform init/validate in specific directory
+    # One pass over the lines, remembering recent cd commands; the earliest
+    # one within the 10 lines before "terraform init" wins
+    if 'terraform init' in build_logs.lower():
+        recent_cds = deque(maxlen=10)
+        for i, line in enumerate(build_logs.split('\n')):
+            if 'terraform init' in line.lower():
+                for line_no, path in recent_cds:
+                    if line_no >= i - 10:
+                        return path, "terraform context"
+            if 'cd' in line:
+                match = _CD_INFRA_RE.search(line)
+                if match:
+                    recent_cds.append((i, match.group(1)))
+    
+    return None, None
+
+
 def generate_missing_variable_fix(explanation: str, context: dict) -> dict:
     """Generate fix for missing Terraform variable"""
     
@@ -138,29 +238,12 @@ def generate_missing_variable_fix(explanation: str, context: dict) -> dict:
         return {}
     
     # Generate Terraform variable block
-    defaults = {
-        'azure_region': 'eastus',
-        'location': 'eastus',
-        'region': 'eastus',
-        'environment': 'dev',
-    }
-    
-    descriptions = {
-        'azure_region': 'Azure region for resource deployment',
-        'location': 'Azure location for resources',
-        'region': 'Deployment region',
-        'environment': 'Environment name',
-    }
+    default_value = _VARIABLE_DEFAULTS.get(var_name, 'CHANGE_ME')
+    description = _VARIABLE_DESCRIPTIONS.get(var_name, f'Value for {var_name}')
     
-    default_value = defaults.get(var_name, 'CHANGE_ME')
-    description = descriptions.get(var_name, f'Value for {var_name}')
-    
-    terraform_code = f'''variable "{var_name}" {{
-  description = "{description}"
-  type        = string
-  default     = "{default_value}"
-}}
-'''
+    terraform_code = _VARIABLE_TEMPLATE.format(
+        name=var_name, description=description, default=default_value
+    )
     
     # Determine filepath
     filepath = determine_filepath(context, 'variables.tf')
@@ -197,7 +280,7 @@ def generate_region_fix(explanation: str, context: dict) -> dict:
     
     # Extract wrong region from Terraform error
     # Pattern: "east-us" was not found in the list of supported Azure Locations
-    match = re.search(r'"([a-z]+-[a-z-]+)" was not found', build_logs, re.IGNORECASE)
+    match = _search(_WRONG_REGION_RE, build_logs)
     if not match:
         logging.error("Could not extract wrong region from logs")
         return {}
@@ -212,33 +295,42 @@ def generate_region_fix(explanation: str, context: dict) -> dict:
     
     # Fetch current main.tf content from GitHub
     try:
-        from github import Github
-        import os
-        
         github_token = os.getenv("GITHUB_TOKEN")
         if not github_token:
             logging.error("GITHUB_TOKEN not set")
             return {}
         
-        g = Github(github_token)
-        repo = g.get_repo("opscart/agentic-devops-healing")
+        repo = get_repo(github_token, "opscart/agentic-devops-healing")
         
         # Get the file
         file_content = repo.get_contents(filepath, ref="main")
+        if isinstance(file_content, list):
+            # A mis-detected path can point at a directory
+            logging.error(f"{filepath} is a directory, not a file")
+            return {}
         current_code = file_content.decoded_content.decode('utf-8')
         
         logging.info(f"Fetched {filepath} from GitHub")
         
         # Replace wrong region with correct one
         # Look for location = "east-us"
-        fixed_code = re.sub(
-            rf'location\s*=\s*"{re.escape(wrong_region)}"',
-            f'location = "{correct_region}"',
-            current_code,
-            flags=re.IGNORECASE
-        )
+        wrong_lower = wrong_region.lower()
+        if wrong_region not in current_code and wrong_lower not in current_code.lower():
+            logging.error("No changes made - pattern not found")
+            return {}
+        
+        replaced = 0
+        
+        def _swap_region(m):
+            nonlocal replaced
+            if m.group(1).lower() != wrong_lower:
+                return m.group(0)
+            replaced += 1
+            return f'location = "{correct_region}"'
+        
+        fixed_code = _LOCATION_ASSIGN_RE.sub(_swap_region, current_code)
         
-        if fixed_code == current_code:
+        if not replaced:
             logging.error("No changes made - pattern not found")
             return {}
         
@@ -248,6 +340,7 @@ def generate_region_fix(explanation: str, context: dict) -> dict:
             filepath: fixed_code
         }
         
-    except Exception as e:
+    except (GithubException, requests.RequestException, UnicodeDecodeError,
+            AssertionError, AttributeError, TypeError) as e:
         logging.error(f"Error fetching/fixing file: {str(e)}")
         return {}
\ No newline at end of file
@@ -4,6 +4,7 @@ Git operations for creating fix PRs
 
 import os
 import logging
+from typing import Optional
 from azure.devops.connection import Connection
 from msrest.authentication import BasicAuthentication
 from azure.devops.v7_0.git.models import GitPullRequest, GitPullRequestCommentThread
@@ -12,15 +13,18 @@ from azure.devops.v7_0.git.models import GitPullRequest, GitPullRequestCommentTh
 class GitOperations:
     """Handle Git operations for auto-fix PRs"""
     
-    def __init__(self):
+    def __init__(self, connection: Optional[Connection] = None):
         self.org_url = os.getenv("ADO_ORG_URL")
         self.pat = os.getenv("ADO_PAT")
         
         if not self.org_url or not self.pat:
             raise ValueError("ADO_ORG_URL and ADO_PAT must be set")
         
-        credentials = BasicAuthentication('', self.pat)
-        self.connection = Connection(base_url=self.org_url, creds=credentials)
+        # Reuse an existing connection (and its HTTP session) when given one
+        if connection is None:
+            credentials = BasicAuthentication('', self.pat)
+            connection = Connection(base_url=self.org_url, creds=credentials)
+        self.connection = connection
         self.git_client = self.connection.clients.get_git_client()
     
     async def create_fix_pr(
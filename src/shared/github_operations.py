@@ -3,9 +3,153 @@ GitHub operations for creating fix PRs
 """
 
 import os
+import random
+import hashlib
 import logging
-from github import Github, GithubException
-from typing import Dict, Optional
+import traceback
+from functools import lru_cache
+
+import requests
+from github import Github, GithubException, InputGitTreeElement
+from github.Repository import Repository
+from typing import Dict, Optional, Tuple
+
+# Branch-name suffixes only need to be unique, not secret, so seed once
+# rather than reading os.urandom per PR
+_rng = random.Random(os.urandom(16))
+
+# One client per token and one Repository per (token, full name), so each
+# fix doesn't pay for a new connection and a get_repo round-trip
+_CLIENT_CACHE: Dict[str, Github] = {}
+_REPO_CACHE: Dict[Tuple[str, str], Repository] = {}
+
+
+def get_github_client(token: str) -> Github:
+    """Shared Github client for this token"""
+    client = _CLIENT_CACHE.get(token)
+    if client is None:
+        client = Github(token, per_page=100, retry=3)
+        _CLIENT_CACHE[token] = client
+    return client
+
+
+def get_repo(token: str, full_name: str) -> Repository:
+    """Cached Repository lookup ("owner/name")"""
+    key = (token, full_name)
+    repo = _REPO_CACHE.get(key)
+    if repo is None:
+        repo = get_github_client(token).get_repo(full_name)
+        _REPO_CACHE[key] = repo
+    return repo
+
+
+# Markdown skeletons for the fix PR; only the fields in braces vary
+_PLACEHOLDER_TEMPLATE = """# Auto-Fix Suggestion
+
+    **Category:** {category}
+    **Confidence:** {confidence}
+
+    ## Root Cause Analysis
+
+    {fix_description}
+
+    ## Suggested Implementation
+
+    Please review the analysis above and implement the necessary changes.
+
+    ## Next Steps
+
+    1. Review this analysis
+    2. Implement the suggested fix
+    3. Test the changes
+    4. Update this PR with actual code changes
+    5. Request review and merge
+
+    ---
+    *Auto-generated by Agentic DevOps Healing*
+    *This document will be replaced once actual code changes are committed*
+    """
+
+_PR_BODY_HEADER = """## Automated Fix by Agentic DevOps Healing
+
+    **Issue Detected:** {category}  
+    **Confidence:** {confidence}
+
+    ### Root Cause Analysis
+
+    {fix_description}
+
+    ### Changes Made
+
+    """
+
+_PR_BODY_FOOTER = """
+
+    ---
+    *This PR was automatically generated by AI analysis of pipeline failure.*  
+    *Please review the changes carefully before merging.*
+
+    **Suggested Actions:**
+    1. Review the proposed changes
+    2. Run the pipeline to verify the fix
+    3. Merge if tests pass
+    """
+
+
+def _git_blob_sha(content: bytes) -> str:
+    """SHA git assigns to a blob with this content"""
+    h = hashlib.sha1()
+    h.update(f"blob {len(content)}\0".encode())
+    h.update(content)
+    return h.hexdigest()
+
+
+def _changed_files(repo, file_changes: Dict[str, str], ref: str) -> Dict[str, Tuple[str, bool]]:
+    """
+    Subset of file_changes whose content differs from ref, checked one path
+    at a time against the blob SHA GitHub reports.
+    Returns {file_path: (new_content, is_new_file)}
+    """
+    changed = {}
+    for file_path, new_content in file_changes.items():
+        try:
+            existing = repo.get_contents(file_path, ref=ref)
+        except GithubException as e:
+            if e.status != 404:
+                raise
+            existing = None
+        
+        # A directory listing comes back as a list; let the commit surface that
+        if isinstance(existing, list) or existing is None or \
+                existing.sha != _git_blob_sha(new_content.encode('utf-8')):
+            changed[file_path] = (new_content, existing is None)
+    return changed
+
+
+@lru_cache(maxsize=64)
+def _parse_github_url(repo_url: str) -> Tuple[Optional[str], Optional[str]]:
+    """(owner, repo_name) for a GitHub URL; the same few URLs recur, so cache it"""
+    if not repo_url:
+        return None, None
+        
+    # Handle various GitHub URL formats
+    # https://github.com/owner/repo
+    # https://github.com/owner/repo.git
+    # git@github.com:owner/repo.git
+    
+    if 'github.com' in repo_url:
+        if repo_url.startswith('git@'):
+            # SSH format: git@github.com:owner/repo.git
+            parts = repo_url.split(':')[1].replace('.git', '').split('/')
+        else:
+            # HTTPS format: https://github.com/owner/repo
+            parts = repo_url.replace('https://', '').replace('http://', '').replace('.git', '').split('/')
+            parts = [p for p in parts if p and p != 'github.com']
+        
+        if len(parts) >= 2:
+            return parts[0], parts[1]
+    
+    return None, None
 
 
 class GitHubOperations:
@@ -17,7 +161,7 @@ class GitHubOperations:
         if not self.token:
             raise ValueError("GITHUB_TOKEN must be set")
         
-        self.client = Github(self.token)
+        self.client = get_github_client(self.token)
         logging.info("GitHub client initialized")
         
     async def _check_existing_pr(
@@ -120,9 +264,12 @@ class GitHubOperations:
                 dict with PR details
             """
             try:
+                category_name = rca.get('category', 'Unknown')
+                confidence_pct = f"{rca.get('confidence', 0) * 100:.0f}%"
+                
                 # Get repository
                 repo_full_name = f"{repo_owner}/{repo_name}"
-                repo = self.client.get_repo(repo_full_name)
+                repo = get_repo(self.token, repo_full_name)
                 
                 logging.info(f"Connected to GitHub repo: {repo_full_name}")
                 
@@ -159,7 +306,8 @@ class GitHubOperations:
                 
                 # Create fix branch name
                 category = rca.get('category', 'fix').lower().replace('_', '-')
-                fix_branch_name = f"auto-fix/{category}-{os.urandom(4).hex()}"
+                suffix = f"{_rng.getrandbits(32):08x}"
+                fix_branch_name = f"auto-fix/{category}-{suffix}"
                 
                 logging.info(f"Creating branch: {fix_branch_name} from {source_branch}")
                 
@@ -176,81 +324,69 @@ class GitHubOperations:
                         source_branch = 'main'
                     else:
                         raise            
+                # Find which files actually differ from the base branch before
+                # creating anything, so a fix that's already there costs no writes
+                changed_files = _changed_files(repo, file_changes or {}, base_sha)
+                
+                if file_changes and not changed_files:
+                    # The fix is already on the base branch; no PR needed
+                    logging.info(f"File changes already on '{source_branch}' - no branch created")
+                    return {
+                        "pr_id": None,
+                        "pr_url": None,
+                        "title": None,
+                        "branch": None,
+                        "status": "no_changes_needed"
+                    }
+                
                 # Create new branch
-                repo.create_git_ref(
+                fix_ref = repo.create_git_ref(
                     ref=f"refs/heads/{fix_branch_name}",
                     sha=base_sha
                 )
                 
                 logging.info(f"Branch created: {fix_branch_name}")
                 
-                # Track if we made any commits
+                # Track if we made any commits, and the PR body line for each file
                 commits_made = False
+                committed_md = []
                 
                 # If we have file changes, apply them
-                if file_changes and len(file_changes) > 0:
-                    logging.info(f"Applying {len(file_changes)} file change(s)")
+                if changed_files:
+                    logging.info(f"Applying {len(changed_files)} file change(s)")
+                    
+                    # Commit every changed file at once through the Git Data
+                    # API: one tree, one commit, one ref update
+                    base_commit = repo.get_git_commit(base_sha)
+                    elements = [
+                        InputGitTreeElement(path=file_path, mode='100644', type='blob', content=new_content)
+                        for file_path, (new_content, _) in changed_files.items()
+                    ]
+                    tree = repo.create_git_tree(elements, base_tree=base_commit.tree)
                     
-                    for file_path, new_content in file_changes.items():
-                        try:
-                            # Try to get existing file
-                            contents = repo.get_contents(file_path, ref=fix_branch_name)
-                            
-                            # Update existing file
-                            repo.update_file(
-                                path=file_path,
-                                message=f"Auto-fix: {rca.get('category', 'Fix issue')}",
-                                content=new_content,
-                                sha=contents.sha,
-                                branch=fix_branch_name
-                            )
-                            logging.info(f"Updated file: {file_path}")
-                            commits_made = True
-                            
-                        except GithubException as e:
-                            if e.status == 404:
-                                # File doesn't exist, create it
-                                repo.create_file(
-                                    path=file_path,
-                                    message=f"Auto-fix: Add {file_path}",
-                                    content=new_content,
-                                    branch=fix_branch_name
-                                )
-                                logging.info(f"Created file: {file_path}")
-                                commits_made = True
-                            else:
-                                raise
+                    new_commit = repo.create_git_commit(
+                        f"Auto-fix: {rca.get('category', 'Fix issue')}",
+                        tree,
+                        [base_commit]
+                    )
+                    fix_ref.edit(new_commit.sha)
+                    
+                    # The PR body lists exactly what the per-path lookup found
+                    for file_path, (_, is_new_file) in changed_files.items():
+                        logging.info(f"Committed file: {file_path}")
+                        committed_md.append(f"- `{file_path}`" + (" (new file)\n" if is_new_file else "\n"))
+                    commits_made = True
                 
                 # If no file changes provided, create a documentation commit
                 if not commits_made:
                     logging.info("No file changes provided - creating fix suggestion document")
                     
                     # Create a placeholder file with the fix suggestion
-                    placeholder_content = f"""# Auto-Fix Suggestion
-
-    **Category:** {rca.get('category', 'Unknown')}
-    **Confidence:** {rca.get('confidence', 0) * 100:.0f}%
-
-    ## Root Cause Analysis
-
-    {fix_description}
-
-    ## Suggested Implementation
-
-    Please review the analysis above and implement the necessary changes.
-
-    ## Next Steps
-
-    1. Review this analysis
-    2. Implement the suggested fix
-    3. Test the changes
-    4. Update this PR with actual code changes
-    5. Request review and merge
-
-    ---
-    *Auto-generated by Agentic DevOps Healing*
-    *This document will be replaced once actual code changes are committed*
-    """
+                    placeholder_content = _PLACEHOLDER_TEMPLATE.format(
+                        category=category_name,
+                        confidence=confidence_pct,
+                        fix_description=fix_description
+                    )
                     
                     # Create the documentation file
                     doc_filename = f"fix-suggestion-{category}.md"
@@ -265,37 +401,21 @@ class GitHubOperations:
                 # Create PR
                 pr_title = f"Auto-fix: {rca.get('category', 'Pipeline Failure').replace('_', ' ').title()}"
                 
-                pr_body = f"""## Automated Fix by Agentic DevOps Healing
-
-    **Issue Detected:** {rca.get('category', 'Unknown')}  
-    **Confidence:** {rca.get('confidence', 0) * 100:.0f}%
-
-    ### Root Cause Analysis
-
-    {fix_description}
-
-    ### Changes Made
-
-    """
+                pr_body_header = _PR_BODY_HEADER.format(
+                    category=category_name,
+                    confidence=confidence_pct,
+                    fix_description=fix_description
+                )
                 
-                if file_changes:
-                    pr_body += "**Modified Files:**\n"
-                    for file_path in file_changes.keys():
-                        pr_body += f"- `{file_path}`\n"
+                parts = [pr_body_header]
+                if committed_md:
+                    parts.append("**Modified Files:**\n")
+                    parts.extend(committed_md)
                 else:
-                    pr_body += "*No file changes included - manual implementation required based on suggestions above.*\n"
+                    parts.append("*No file changes included - manual implementation required based on suggestions above.*\n")
                 
-                pr_body += """
-
-    ---
-    *This PR was automatically generated by AI analysis of pipeline failure.*  
-    *Please review the changes carefully before merging.*
-
-    **Suggested Actions:**
-    1. Review the proposed changes
-    2. Run the pipeline to verify the fix
-    3. Merge if tests pass
-    """
+                parts.append(_PR_BODY_FOOTER)
+                pr_body = "".join(parts)
                 
                 # Create the pull request
                 pr = repo.create_pull(
@@ -322,9 +442,8 @@ class GitHubOperations:
                     "status": "created"
                 }
                 
-            except Exception as e:
+            except (GithubException, requests.RequestException) as e:
                 logging.error(f"Error creating GitHub PR: {str(e)}")
-                import traceback
                 logging.error(traceback.format_exc())
                 raise
 
@@ -338,24 +457,4 @@ class GitHubOperations:
             Returns:
                 Tuple of (owner, repo_name)
             """
-            if not repo_url:
-                return None, None
-                
-            # Handle various GitHub URL formats
-            # https://github.com/owner/repo
-            # https://github.com/owner/repo.git
-            # git@github.com:owner/repo.git
-            
-            if 'github.com' in repo_url:
-                if repo_url.startswith('git@'):
-                    # SSH format: git@github.com:owner/repo.git
-                    parts = repo_url.split(':')[1].replace('.git', '').split('/')
-                else:
-                    # HTTPS format: https://github.com/owner/repo
-                    parts = repo_url.replace('https://', '').replace('http://', '').replace('.git', '').split('/')
-                    parts = [p for p in parts if p and p != 'github.com']
-                
-                if len(parts) >= 2:
-                    return parts[0], parts[1]
-            
-            return None, None
\ No newline at end of file
+            return _parse_github_url(repo_url)
@@ -6,7 +6,7 @@ from dataclasses import dataclass
 from typing import Optional, Dict, List
 
 
-@dataclass
+@dataclass(slots=True)
 class FailureContext:
     """Context about a pipeline failure"""
     pipeline_id: str
@@ -23,7 +23,7 @@ class FailureContext:
     timestamp: str
 
 
-@dataclass
+@dataclass(slots=True)
 class RCAResult:
     """Result of root cause analysis"""
     category: str
@@ -4,7 +4,13 @@ OpenAI Client for Azure OpenAI Service or OpenAI API
 
 import os
 import logging
-from openai import OpenAI
+from functools import lru_cache
+
+import httpx
+from openai import AsyncOpenAI, OpenAIError
+
+# Keep-alive connections held open to the OpenAI endpoint
+OPENAI_MAX_KEEPALIVE = 20
 
 
 class OpenAIClient:
@@ -18,23 +24,41 @@ class OpenAIClient:
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY must be set")
         
+        # Reasoning models (o1, o3, gpt-5.x series) take max_completion_tokens
+        model = self.model.lower()
+        is_reasoning_model = (
+            model.startswith(('o1', 'o3')) or
+            'gpt-5' in model or
+            'gpt5' in model
+        )
+        self._token_param = "max_completion_tokens" if is_reasoning_model else "max_tokens"
+        logging.info(f"Using model: {self.model}, is_reasoning_model: {is_reasoning_model}")
+        
         # Check if using Azure OpenAI or standard OpenAI
         if self.endpoint and "azure" in self.endpoint.lower():
             # Azure OpenAI
-            from openai import AzureOpenAI
+            from openai import AsyncAzureOpenAI
             self.api_version = os.getenv("OPENAI_API_VERSION", "2024-08-01-preview")
             
-            self.client = AzureOpenAI(
+            self.client = AsyncAzureOpenAI(
                 azure_endpoint=self.endpoint,
                 api_key=self.api_key,
-                api_version=self.api_version
+                api_version=self.api_version,
+                http_client=self._http_client()
             )
         else:
             # Standard OpenAI API (openai.com)
-            self.client = OpenAI(
-                api_key=self.api_key
+            self.client = AsyncOpenAI(
+                api_key=self.api_key,
+                http_client=self._http_client()
             )
     
+    @staticmethod
+    def _http_client() -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=OPENAI_MAX_KEEPALIVE)
+        )
+    
     async def analyze(self, prompt: str, system_message: str = None) -> str:
         """Send a prompt to OpenAI and get response"""
         try:
@@ -51,36 +75,27 @@ class OpenAIClient:
                 "content": prompt
             })
             
-            # Check if using reasoning models (o1, o3, gpt-5.x series)
-            model = self.model.lower()
-            is_reasoning_model = (
-                model.startswith('o1') or 
-                model.startswith('o3') or 
-                'gpt-5' in model or
-                'gpt5' in model
-            )
-            
-            logging.info(f"Using model: {self.model}, is_reasoning_model: {is_reasoning_model}")
-            
             # Build request parameters
             request_params = {
                 "model": self.model,
                 "messages": messages,
                 "temperature": 0.3,
+                self._token_param: 2000,
             }
             
-            # Use appropriate token parameter
-            if is_reasoning_model:
-                request_params["max_completion_tokens"] = 2000
-                logging.info("Using max_completion_tokens for reasoning model")
-            else:
-                request_params["max_tokens"] = 2000
-                logging.info("Using max_tokens for standard model")
-            
-            response = self.client.chat.completions.create(**request_params)
+            response = await self.client.chat.completions.create(**request_params)
             
             return response.choices[0].message.content
             
-        except Exception as e:
+        except OpenAIError as e:
             logging.error(f"Error calling OpenAI: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+
+@lru_cache(maxsize=1)
+def get_client() -> OpenAIClient:
+    """
+    Shared OpenAIClient; use this rather than OpenAIClient() so every call
+    reuses the same connection pool
+    """
+    return OpenAIClient()